@@ -1,11 +1,25 @@
 # app.py
 
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 import os
 from yolo_detector import detect_and_count
 
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Route Flask's JSON encode/decode through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 CORS(app)
 
 UPLOAD_FOLDER = "uploads"
@@ -32,4 +46,5 @@ def predict():
 
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # Development server only - use gunicorn.conf.py in production
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get("FLASK_DEBUG") == "1", threaded=False)
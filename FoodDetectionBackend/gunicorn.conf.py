@@ -0,0 +1,18 @@
+"""
+Gunicorn config for the food detection API (Linux/Mac production).
+Run from FoodDetectionBackend/: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = "0.0.0.0:5001"
+worker_class = "gthread"
+threads = 4
+
+# Detection is stateless, so scale out to one worker per core
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+# Load food_model.pt once in the master; forked workers share the weights
+# copy-on-write instead of each loading their own copy. Each worker builds
+# its own predictor (and CUDA context) on first request; see yolo_detector
+preload_app = True
@@ -3,8 +3,10 @@ Flask API: Conversational Fitness Agent Endpoint
 Production-ready endpoint using state-machine architecture.
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import logging
+import orjson
 import os
 import sys
 
@@ -14,13 +16,46 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from core.conversation_manager import ConversationManager
 
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Route Flask's JSON encode/decode through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def json_response(payload, status=200):
+    """Build a JSON response directly from orjson bytes, skipping jsonify."""
+    return Response(
+        orjson.dumps(payload, default=str, option=ORJSON_OPTIONS),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app, 
-     resources={r"/*": {"origins": "*"}},
-     methods=['GET', 'POST', 'OPTIONS', 'PUT', 'DELETE'],
-     allow_headers=['Content-Type', 'Authorization'],
-     supports_credentials=True)
+app.json = OrJSONProvider(app)
+
+
+@app.after_request
+def add_cors_headers(response):
+    """Static CORS headers for every response (any origin, no credentials)."""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS,PUT,DELETE'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
+    return response
+
+@app.route('/<path:_>', methods=['OPTIONS'])
+def cors_preflight(_):
+    return '', 204
 
 # Initialize Conversation Manager (Singleton)
 # Persist data in data/user_profiles.json
@@ -30,11 +65,11 @@ conversation_manager = ConversationManager(os.path.join(DATA_DIR, 'user_profiles
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({
+    return json_response({
         "status": "healthy",
         "service": "conversational-fitness-agent",
         "version": "2.0.0"
-    }), 200
+    }, 200)
 
 # @app.route('/chat', methods=['POST'])
 # def chat():
@@ -79,17 +114,27 @@ def chat():
     """
 
     try:
-        # Get JSON safely
-        data = request.get_json(silent=True)  # silent=True avoids errors if JSON missing
+        # Decode the body with orjson; empty or malformed bodies are a 400
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            data = None
         if not data:
-            return jsonify({"error": "Invalid JSON"}), 400
+            return json_response({"error": "Invalid JSON"}, 400)
 
         message = data.get('message')
         user_id = data.get('user_id')
         profile_update = data.get('profile') # Accept optional profile data
 
         if not message or not user_id:
-            return jsonify({"error": "Missing message or user_id"}), 400
+            return json_response({"error": "Missing message or user_id"}, 400)
+
+        # Clients that accept NDJSON get the reply as it is produced
+        if 'application/x-ndjson' in request.headers.get('Accept', ''):
+            return Response(
+                stream_with_context(_stream_chat(user_id, message, profile_update)),
+                mimetype='application/x-ndjson'
+            )
 
         # Process message through state machine
         response_text = conversation_manager.process_message(user_id, message, profile_update)
@@ -97,17 +142,32 @@ def chat():
         # Get current state for debugging/frontend context
         user_state = conversation_manager.get_user_conversation(user_id)
 
-        return jsonify({
+        return json_response({
             "status": "success",
             "response": response_text,
             "state": user_state["current_state"],
             "week": user_state["profile"].get("current_week", 1)
-        }), 200
+        }, 200)
+
+    except Exception as e:
+        logger.exception("chat handler failed")
+        return json_response({"status": "error", "error": str(e)}, 500)
+
+def _stream_chat(user_id, message, profile_update):
+    """Yield {"chunk": ...} lines, then a final line with state metadata."""
+    try:
+        for chunk in conversation_manager.process_message_stream(user_id, message, profile_update):
+            yield orjson.dumps({"chunk": chunk}) + b"\n"
 
+        user_state = conversation_manager.get_user_conversation(user_id)
+        yield orjson.dumps({
+            "status": "success",
+            "state": user_state["current_state"],
+            "week": user_state["profile"].get("current_week", 1)
+        }, option=ORJSON_OPTIONS) + b"\n"
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"status": "error", "error": str(e)}), 500
+        logger.exception("chat stream failed")
+        yield orjson.dumps({"status": "error", "error": str(e)}) + b"\n"
 
 @app.route('/reset', methods=['POST'])
 def reset():
@@ -117,15 +177,12 @@ def reset():
         user_id = data.get('user_id')
         if not user_id: return jsonify({"error": "Missing user_id"}), 400
         
-        # Manually reset
-        if user_id in conversation_manager.conversations:
-            conversation_manager.conversations[user_id]["current_state"] = conversation_manager.STATE_GREETING
-            conversation_manager.conversations[user_id]["profile"] = {
-                "weight_kg": None, "height_cm": None, "age": None, "gender": "female",
-                "activity_level": None, "fitness_goal": None, "current_week": 1,
-                "dietary_restrictions": []
-            }
-            conversation_manager._save_conversations()
+        # Manually reset (users evicted from memory only have their shard)
+        if conversation_manager.has_user(user_id):
+            conv = conversation_manager.get_user_conversation(user_id)
+            conv["current_state"] = conversation_manager.STATE_GREETING
+            conv["profile"] = {**conversation_manager._NEW_PROFILE, "dietary_restrictions": []}
+            conversation_manager._save_conversations(user_id)
             
         return jsonify({"status": "success", "message": "Conversation reset"}), 200
     except Exception as e:
@@ -135,4 +192,5 @@ if __name__ == '__main__':
     print("=" * 70)
     print("Conversational Agent API Starting [START]")
     print("=" * 70)
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only - use gunicorn.conf.py in production
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get("FLASK_DEBUG") == "1", threaded=False)
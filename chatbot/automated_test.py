@@ -19,10 +19,18 @@ import os
 import json
 import traceback
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import warnings
 from datetime import datetime
+from collections import namedtuple
 from typing import List, Dict, Tuple
 
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json for report writing
+    orjson = None
+
 # Suppress harmless sklearn version warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="sklearn")
 
@@ -31,6 +39,9 @@ project_root = os.path.dirname(os.path.abspath(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+# Tests don't need conversation state to survive on disk
+os.environ["FITNESS_CHATBOT_PERSIST"] = "0"
+
 # IMPORT YOUR ACTUAL MODULE
 try:
     from core.conversation_manager import ConversationManager
@@ -40,95 +51,56 @@ except ImportError as e:
     sys.exit(1)
 
 
+# Calorie patterns compiled once, tried in priority order (daily totals first)
+_CALORIE_PATTERNS = tuple(
+    re.compile(pattern)
+    for pattern in (
+        r"daily totals[^}]*?calories?:\s*(\d{3,})",
+        r"total:\s*(\d{3,})\s*kcal",
+        r"(\d{3,})\s*kcal",
+        r"(\d{3,})\s*calories",
+    )
+)
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7f]+")
+
+# Response checks: one regex pass per step over the lowercased reply
+_INVALID_RE = re.compile(r"invalid|number|try again|not understand")
+_HEIGHT_OR_AGE_RE = re.compile(r"height|old")
+_AGE_PROMPT_RE = re.compile(r"old|age")
+_PLAN_RE = re.compile(r"calorie|meal")
+
+# Test profile: compact tuple with attribute access
+Profile = namedtuple("Profile", "goal_input fitness_goal weight height age activity")
+
+
 class AutomatedTester:
     def __init__(self, save_report: bool = False):
         self.save_report = save_report
         self.results = []
         self.start_time = None
+        self._manager = None
 
-    def generate_test_profiles(self, mode: str = "full") -> List[Dict]:
+    @property
+    def manager(self) -> ConversationManager:
+        """One manager per process; tests are isolated by unique user_id"""
+        if self._manager is None:
+            # Default store, read-only (FITNESS_CHATBOT_PERSIST=0 above)
+            self._manager = ConversationManager()
+        return self._manager
+
+    def generate_test_profiles(self, mode: str = "full") -> List[Profile]:
         """Generate diverse profiles — normal + edge cases"""
         profiles = [
-            {
-                "goal_input": "gain muscle",
-                "fitness_goal": "muscle_gain",
-                "weight": 89,
-                "height": 178,
-                "age": 30,
-                "activity": "moderate",
-            },
-            {
-                "goal_input": "lose weight",
-                "fitness_goal": "weight_loss",
-                "weight": 100,
-                "height": 170,
-                "age": 45,
-                "activity": "sedentary",
-            },
-            {
-                "goal_input": "maintain weight",
-                "fitness_goal": "maintenance",
-                "weight": 70,
-                "height": 175,
-                "age": 28,
-                "activity": "active",
-            },
-            {
-                "goal_input": "gain muscle",
-                "fitness_goal": "muscle_gain",
-                "weight": 45,
-                "height": 145,
-                "age": 18,
-                "activity": "sedentary",
-            },  # Safety patch test
-            {
-                "goal_input": "gain muscle",
-                "fitness_goal": "muscle_gain",
-                "weight": 60,
-                "height": 165,
-                "age": 22,
-                "activity": "light",
-            },  # Safety patch test
-            {
-                "goal_input": "lose weight",
-                "fitness_goal": "weight_loss",
-                "weight": 50,
-                "height": 160,
-                "age": 65,
-                "activity": "light",
-            },  # Safety floor test
-            {
-                "goal_input": "lose weight",
-                "fitness_goal": "weight_loss",
-                "weight": 75,
-                "height": 170,
-                "age": 30,
-                "activity": "sedentary",
-            },  # Safety floor test
-            {
-                "goal_input": "gain muscle",
-                "fitness_goal": "muscle_gain",
-                "weight": "seventy",
-                "height": "175",
-                "age": "30",
-                "activity": "moderate",
-            },  # Invalid weight
-            {
-                "goal_input": "lose weight",
-                "fitness_goal": "weight_loss",
-                "weight": "80",
-                "height": "six feet",
-                "age": "40",
-                "activity": "active",
-            },  # Invalid height
-            {
-                "goal_input": "gain muscle",
-                "fitness_goal": "muscle_gain",
-                "weight": 200,
-                "height": 210,
-                "age": 25,
-                "activity": "very active",
-            },  # Extreme value
+            Profile("gain muscle", "muscle_gain", 89, 178, 30, "moderate"),
+            Profile("lose weight", "weight_loss", 100, 170, 45, "sedentary"),
+            Profile("maintain weight", "maintenance", 70, 175, 28, "active"),
+            Profile("gain muscle", "muscle_gain", 45, 145, 18, "sedentary"),  # Safety patch test
+            Profile("gain muscle", "muscle_gain", 60, 165, 22, "light"),  # Safety patch test
+            Profile("lose weight", "weight_loss", 50, 160, 65, "light"),  # Safety floor test
+            Profile("lose weight", "weight_loss", 75, 170, 30, "sedentary"),  # Safety floor test
+            Profile("gain muscle", "muscle_gain", "seventy", "175", "30", "moderate"),  # Invalid weight
+            Profile("lose weight", "weight_loss", "80", "six feet", "40", "active"),  # Invalid height
+            Profile("gain muscle", "muscle_gain", 200, 210, 25, "very active"),  # Extreme value
         ]
 
         if mode == "full":
@@ -144,27 +116,22 @@ class AutomatedTester:
                     ]
                 )
                 profiles.append(
-                    {
-                        "goal_input": goal_choice[0],
-                        "fitness_goal": goal_choice[1],
-                        "weight": random.choice(
-                            [30, 40, 50, 60, 70, 80, 90, 100, 120, 150, 200]
-                        ),
-                        "height": random.choice(
-                            [140, 150, 160, 170, 180, 190, 200, 210]
-                        ),
-                        "age": random.choice([16, 18, 25, 35, 45, 55, 65, 75, 85]),
-                        "activity": random.choice(
+                    Profile(
+                        *goal_choice,
+                        random.choice([30, 40, 50, 60, 70, 80, 90, 100, 120, 150, 200]),
+                        random.choice([140, 150, 160, 170, 180, 190, 200, 210]),
+                        random.choice([16, 18, 25, 35, 45, 55, 65, 75, 85]),
+                        random.choice(
                             ["sedentary", "light", "moderate", "active", "very active"]
                         ),
-                    }
+                    )
                 )
         return profiles[:10] if mode == "fast" else profiles
 
-    def simulate_conversation(self, profile: Dict, user_id: str) -> Tuple[bool, Dict]:
+    def simulate_conversation(self, profile: Profile, user_id: str) -> Tuple[bool, Dict]:
         """Drive conversation with CORRECT state flow + field names"""
         try:
-            manager = ConversationManager()
+            manager = self.manager
 
             # Step 0: Initial greeting to exit STATE_GREETING
             response = manager.process_message(user_id, "hi")
@@ -175,7 +142,7 @@ class AutomatedTester:
                 }
 
             # Step 1: Goal (use goal_input for user message, fitness_goal for validation)
-            response = manager.process_message(user_id, profile["goal_input"])
+            response = manager.process_message(user_id, profile.goal_input)
             if "weight" not in response.lower():
                 return False, {
                     "error": "Did not prompt for weight after goal",
@@ -183,50 +150,46 @@ class AutomatedTester:
                 }
 
             # Step 2: Weight
-            weight_input = str(profile["weight"])
+            weight_input = str(profile.weight)
             response = manager.process_message(user_id, weight_input)
+            response_lower = response.lower()
 
             # Handle invalid numeric input
-            if not isinstance(profile["weight"], (int, float)):
-                if any(
-                    kw in response.lower()
-                    for kw in ["invalid", "number", "try again", "not understand"]
-                ):
+            if not isinstance(profile.weight, (int, float)):
+                if _INVALID_RE.search(response_lower):
                     return True, {
                         "skipped": "Invalid input correctly rejected",
                         "input": weight_input,
                     }
                 # If not rejected, continue (system may have parsed it)
 
-            if "height" not in response.lower() and "old" not in response.lower():
+            if not _HEIGHT_OR_AGE_RE.search(response_lower):
                 return False, {
                     "error": "Did not prompt for height/age after weight",
                     "response": response[:100],
                 }
 
             # Step 3: Height
-            height_input = str(profile["height"])
+            height_input = str(profile.height)
             response = manager.process_message(user_id, height_input)
+            response_lower = response.lower()
 
             # Handle invalid height input
-            if not isinstance(profile["height"], (int, float)):
-                if any(
-                    kw in response.lower()
-                    for kw in ["invalid", "number", "try again", "not understand"]
-                ):
+            if not isinstance(profile.height, (int, float)):
+                if _INVALID_RE.search(response_lower):
                     return True, {
                         "skipped": "Invalid height input correctly rejected",
                         "input": height_input,
                     }
 
-            if "old" not in response.lower() and "age" not in response.lower():
+            if not _AGE_PROMPT_RE.search(response_lower):
                 return False, {
                     "error": "Did not prompt for age after height",
                     "response": response[:100],
                 }
 
             # Step 4: Age
-            age_input = str(profile["age"])
+            age_input = str(profile.age)
             response = manager.process_message(user_id, age_input)
             if "activity" not in response.lower():
                 return False, {
@@ -235,10 +198,10 @@ class AutomatedTester:
                 }
 
             # Step 5: Activity level
-            response = manager.process_message(user_id, profile["activity"])
+            response = manager.process_message(user_id, profile.activity)
 
             # Step 6: Validate meal plan generation
-            if "calorie" not in response.lower() and "meal" not in response.lower():
+            if not _PLAN_RE.search(response.lower()):
                 return False, {
                     "error": "No meal plan generated",
                     "response": response[:150],
@@ -254,7 +217,7 @@ class AutomatedTester:
 
             # ✅ CRITICAL FIX #1: Use CORRECT field name "fitness_goal"
             # ✅ CRITICAL FIX #2: Use CORRECT value "muscle_gain" (not "gain muscle")
-            goal = profile["fitness_goal"]
+            goal = profile.fitness_goal
 
             # SAFETY FLOOR VALIDATION (based on actual system behavior)
             safety_issue = None
@@ -306,20 +269,10 @@ class AutomatedTester:
 
     def _extract_calories(self, text: str) -> int:
         """Extract calorie number safely (handles Windows Unicode/emoji issues)"""
-        try:
-            text_clean = text.encode("ascii", "ignore").decode("ascii").lower()
-        except:
-            text_clean = text.lower()
-
-        # Match calorie patterns (more robust)
-        patterns = [
-            r"daily totals[^}]*?calories?:\s*(\d{3,})",
-            r"total:\s*(\d{3,})\s*kcal",
-            r"(\d{3,})\s*kcal",
-            r"(\d{3,})\s*calories",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text_clean)
+        text_clean = _NON_ASCII_RE.sub("", text).lower()
+
+        for pattern in _CALORIE_PATTERNS:
+            match = pattern.search(text_clean)
             if match:
                 return int(match.group(1).replace(",", ""))
         return 0
@@ -333,30 +286,55 @@ class AutomatedTester:
         )
         print("=" * 70)
 
-        for i, profile in enumerate(profiles, 1):
-            user_id = f"test_user_{i}_{int(datetime.now().timestamp() * 1000)}"  # Millisecond precision
-            goal_short = profile["fitness_goal"][:4]
-            desc = f"{goal_short} | {profile['weight']}kg | {profile['height']}cm | {profile['age']}yo | {profile['activity'][:4]}"
-            print(f"[{i:2d}/{len(profiles)}] {desc:48s}", end=" → ", flush=True)
+        # i keeps ids unique within a run; one clock read separates runs
+        run_stamp = time.time_ns() // 1_000_000
+        jobs = [
+            (i, profile, f"test_user_{i}_{run_stamp}")
+            for i, profile in enumerate(profiles, 1)
+        ]
+        outcomes = {}
+        next_to_print = 1
+
+        # Profiles are state-isolated, so run them across worker processes
+        workers = min(os.cpu_count() or 1, len(jobs)) or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+            futures = {
+                ex.submit(_run_one, profile, user_id): i for i, profile, user_id in jobs
+            }
+            for future in as_completed(futures):
+                outcomes[futures[future]] = future.result()
+                # Print in submission order as soon as the next result is ready
+                while next_to_print in outcomes:
+                    self._print_outcome(
+                        next_to_print, profiles, *outcomes[next_to_print]
+                    )
+                    next_to_print += 1
 
-            passed, details = self.simulate_conversation(profile, user_id)
+        for i, profile, _ in jobs:
+            passed, details = outcomes[i]
             self.results.append(
                 {"profile": profile, "passed": passed, "details": details}
             )
 
-            if passed:
-                calories = details.get("calories", "N/A")
-                print(f"✅ PASS ({calories} kcal)")
-            else:
-                print(f"❌ FAIL")
-                if "skipped" not in details:
-                    error_msg = details.get("error", "Unknown error")
-                    if len(error_msg) > 80:
-                        error_msg = error_msg[:77] + "..."
-                    print(f"      → {error_msg}")
-
         self.generate_report()
 
+    def _print_outcome(self, i: int, profiles: List[Profile], passed: bool, details: Dict):
+        profile = profiles[i - 1]
+        goal_short = profile.fitness_goal[:4]
+        desc = f"{goal_short} | {profile.weight}kg | {profile.height}cm | {profile.age}yo | {profile.activity[:4]}"
+        print(f"[{i:2d}/{len(profiles)}] {desc:48s}", end=" → ")
+
+        if passed:
+            calories = details.get("calories", "N/A")
+            print(f"✅ PASS ({calories} kcal)")
+        else:
+            print(f"❌ FAIL")
+            if "skipped" not in details:
+                error_msg = details.get("error", "Unknown error")
+                if len(error_msg) > 80:
+                    error_msg = error_msg[:77] + "..."
+                print(f"      → {error_msg}")
+
     def generate_report(self):
         """Output report (save ONLY if --save flag provided)"""
         duration = (datetime.now() - self.start_time).total_seconds()
@@ -371,7 +349,7 @@ class AutomatedTester:
             "pass_rate": f"{(passed / len(self.results)) * 100:.1f}%",
             "duration_sec": round(duration, 2),
             "failures": [
-                {"profile": r["profile"], "error": r["details"].get("error", "Unknown")}
+                {"profile": r["profile"]._asdict(), "error": r["details"].get("error", "Unknown")}
                 for r in self.results
                 if not r["passed"] and "skipped" not in r["details"]
             ],
@@ -408,8 +386,12 @@ class AutomatedTester:
         # SAVE ONLY IF EXPLICITLY REQUESTED (--save flag)
         if self.save_report:
             filename = f"test_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(report, f, indent=2, ensure_ascii=False)
+            if orjson is not None:
+                with open(filename, "wb") as f:
+                    f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+            else:
+                with open(filename, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2, ensure_ascii=False)
             print(f"\n💾 Report SAVED to: {filename}")
         else:
             print("\nℹ️  Report NOT saved (use --save flag to save)")
@@ -421,6 +403,19 @@ class AutomatedTester:
         sys.exit(0 if passed > 0 else 1)
 
 
+# Per-process tester used by pool workers (built once in _init_worker)
+_worker_tester = None
+
+
+def _init_worker():
+    global _worker_tester
+    _worker_tester = AutomatedTester()
+
+
+def _run_one(profile: Profile, user_id: str) -> Tuple[bool, Dict]:
+    return _worker_tester.simulate_conversation(profile, user_id)
+
+
 if __name__ == "__main__":
     # Parse flags
     mode = "fast" if "--fast" in sys.argv else "full"
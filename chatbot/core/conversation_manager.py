@@ -3,15 +3,37 @@ Conversation Manager: State Machine for Progressive Onboarding
 Handles natural conversation flow - collects user profile BEFORE generating plans.
 """
 
+import atexit
+import functools
+import hashlib
 import json
+import logging
+import logging.handlers
 import os
+import queue
 import re
+import signal
 import sys
-from typing import Dict, Tuple, Optional, Any
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional, Any
+from datetime import datetime
+from urllib.parse import quote
 # removed library: from dotenv import load_dotenv
 import google.generativeai as genai
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps persistence working without orjson
+    orjson = None
+
+try:
+    import ahocorasick
+except ImportError:  # _match_keyword falls back to substring scans
+    ahocorasick = None
+
 # Add core and root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
@@ -26,6 +48,121 @@ from core.food_recommender import FoodRecommender
 # IntentClassifier is not strictly needed for this flow but good to have if we expand
 # from core.intent_classifier import IntentClassifier
 
+# Onboarding number parsing (compiled once; used on every onboarding turn)
+_UNIT_RE = re.compile(
+    r"(kg|kilogram|kilograms|cm|centimeter|centimeters|years?|old)", re.IGNORECASE
+)
+_NUM_RE = re.compile(r"(\d+\.?\d*)")
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to indented UTF-8 JSON bytes (orjson when available)."""
+    if orjson is not None:
+        # Indenting in C is nearly free, so shards stay hand-editable
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Read-only models shared by every ConversationManager in the process.
+# Loaded on first use, or up front via preload_models() so that a
+# preforking server's workers inherit them copy-on-write.
+@functools.lru_cache(maxsize=None)
+def _shared_roadmap_generator() -> RoadmapGenerator:
+    print("[ConversationManager] Loading roadmap model...")
+    return RoadmapGenerator.get(
+        model_path=os.path.join(root_dir, "RoadMap_model", "roadmap_model.pkl")
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_food_recommender() -> FoodRecommender:
+    print("[ConversationManager] Loading food database...")
+    return FoodRecommender(
+        database_path=os.path.join(
+            root_dir, "model_3_build", "model3_food_database.json"
+        )
+    )
+
+
+def preload_models():
+    """Load the shared models now instead of on the first plan request."""
+    _shared_roadmap_generator()
+    _shared_food_recommender()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as-is; message and traceback are formatted by the listener."""
+
+    def prepare(self, record):
+        return record
+
+
+# Errors are logged from request threads: hand records to a background
+# listener so traceback formatting and stderr writes stay off the request path
+logger = logging.getLogger(__name__)
+logger.propagate = False
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(
+    logging.Formatter("[ConversationManager] %(levelname)s: %(message)s")
+)
+_log_queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+logger.addHandler(_log_queue_handler)
+_log_listener = None
+
+
+def _start_log_listener():
+    """(Re)start the listener thread; threads don't survive fork."""
+    global _log_listener
+    _log_queue_handler.queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(
+        _log_queue_handler.queue, _log_stream_handler
+    )
+    _log_listener.start()
+
+
+_start_log_listener()
+atexit.register(lambda: _log_listener.stop())
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_start_log_listener)
+
+
+# Managers with pending writes are drained on interpreter exit / SIGTERM
+_ACTIVE_MANAGERS = weakref.WeakSet()
+_shutdown_hooks_installed = False
+_previous_sigterm_handler = None
+
+
+def _flush_all_managers():
+    for manager in list(_ACTIVE_MANAGERS):
+        manager._flush()
+
+
+def _handle_sigterm(signum, frame):
+    _flush_all_managers()
+    if callable(_previous_sigterm_handler):
+        _previous_sigterm_handler(signum, frame)
+    else:
+        raise SystemExit(128 + signum)
+
+
+def _install_shutdown_hooks():
+    """Register the exit/SIGTERM flush once per process."""
+    global _shutdown_hooks_installed, _previous_sigterm_handler
+    if _shutdown_hooks_installed:
+        return
+    _shutdown_hooks_installed = True
+    atexit.register(_flush_all_managers)
+    try:
+        _previous_sigterm_handler = signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError:
+        # signal handlers can only be installed from the main thread
+        pass
+
 
 class ConversationManager:
     """
@@ -57,6 +194,16 @@ class ConversationManager:
     MIN_AGE = 13
     MAX_AGE = 100
 
+    # Coalesce bursts of writes into one flush per window (seconds)
+    SAVE_DEBOUNCE_SECONDS = 2.0
+    # Turns that change nothing else only persist last_interaction this often
+    LAST_SEEN_RESOLUTION_SECONDS = 60
+    # Conversations idle longer than this restart from the greeting
+    STALE_AFTER_SECONDS = 7 * 24 * 3600
+    # Resident conversations; least recently used ones are dropped from
+    # memory and reloaded from their shard on the next message
+    MAX_ACTIVE_CONVERSATIONS = 10000
+
     # Activity levels
     ACTIVITY_LEVELS = {
         "sedentary": ["sedentary", "sitting", "desk", "inactive", "lazy"],
@@ -73,6 +220,46 @@ class ConversationManager:
         "maintenance": ["maintain", "stay", "keep", "stable", "preserve"],
     }
 
+    # Profile templates, copied per user (mutable fields are replaced on copy)
+    _NEW_PROFILE = {
+        "weight_kg": None,
+        "height_cm": None,
+        "age": None,
+        "gender": "female",  # Defaulting to female if not collected, helps Model 2
+        "activity_level": None,
+        "fitness_goal": None,
+        "current_week": 1,
+        "dietary_restrictions": (),
+    }
+    _RESET_PROFILE = {**_NEW_PROFILE, "dietary_restrictions": "", "allergens": ()}
+
+    # Commands and replies matched against the whole normalized message
+    _RESET_COMMANDS = frozenset(
+        ["reset", "restart", "start over", "new", "new plan", "quit", "stop"]
+    )
+    _STOP_COMMANDS = frozenset(["quit", "stop"])
+    _PLAN_REQUEST_KEYWORDS = ("diet plan", "show plan", "generate plan", "get plan")
+    _PLAN_REQUIRED_FIELDS = ("weight_kg", "height_cm", "age", "activity_level", "fitness_goal")
+    _NONE_REPLIES = frozenset(["none", "no", "nothing", "na"])
+
+    # Fixed replies
+    _MSG_STOPPED = "Conversation stopped and data cleared. How else can I help you today?"
+    _MSG_RESET = "Starting fresh! What's your new goal? (lose weight / gain muscle / maintain)"
+    _MSG_GREETING = "Hi! I'm your AI fitness coach. 😊 What's your goal today? (lose weight / gain muscle / maintain)"
+    _MSG_GOAL_SET = "Great goal! 💪 What's your current weight in kg?"
+    _MSG_GOAL_RETRY = "I didn't catch that. Please choose: lose weight, gain muscle, or maintain."
+    _MSG_WEIGHT_RETRY = "I need a number like '70' (not 'seventy'). What's your weight in kg?"
+    _MSG_HEIGHT_RETRY = "I need a number like '170' (not 'one seventy'). What's your height in cm?"
+    _MSG_AGE_RETRY = "I need a number like '25'. How old are you?"
+    _MSG_AGE_RANGE = "Please enter a realistic age (13-100 years)."
+    _MSG_VEG_SET = "Noted! 🥦 Any other dietary restrictions? (e.g., Low carb, Halal, No red meat, or 'None')"
+    _MSG_NON_VEG_SET = "Got it! 🍗 Any other dietary restrictions? (e.g., Low carb, Halal, No red meat, or 'None')"
+    _MSG_DIET_RETRY = "Please specify: Are you veg or non-veg?"
+    _MSG_ALLERGIES = "Almost there! Any known allergies? (Dairy, Eggs, Fish, Gluten, Wheat, Soy, Tree Nuts, Peanuts, or 'None')"
+    _MSG_ACTIVITY = "Last question! What's your activity level? (sedentary/light/moderate/active)"
+    _MSG_ACTIVITY_RETRY = f"Please choose: {', '.join(ACTIVITY_LEVELS)}"
+    _MSG_SHOWING_ROADMAP = "I've designed this plan for you. Type 'reset' to start over or let me know if you need adjustments!"
+
     def __init__(self, storage_path: str = None):
         """
         Initialize conversation manager and models.
@@ -81,8 +268,57 @@ class ConversationManager:
             self.storage_path = storage_path
         else:
             self.storage_path = os.path.join(root_dir, "data", "user_profiles.json")
+        # One shard per user: data/profiles/<uid>.json
+        self.profiles_dir = os.path.join(os.path.dirname(self.storage_path), "profiles")
+
+        # Shards load lazily in get_user_conversation
+        self.conversations = OrderedDict()
+
+        # Debounced persistence state
+        self._dirty = set()
+        self._resident = set()  # uids loaded into self.conversations
+        self._flush_timer = None
+        self._save_lock = threading.Lock()
+        # FITNESS_CHATBOT_PERSIST=0 keeps conversations in memory only
+        # (test harnesses); shards are still read, never written
+        self._persist = os.environ.get("FITNESS_CHATBOT_PERSIST", "1") != "0"
+        self._migrate_single_file_store()
+        _ACTIVE_MANAGERS.add(self)
+        _install_shutdown_hooks()
+
+        # One handler per onboarding state; unknown states go to Gemini
+        self._state_handlers = {
+            self.STATE_GREETING: self._handle_greeting,
+            self.STATE_ONBOARDING_GOAL: self._handle_goal,
+            self.STATE_ONBOARDING_WEIGHT: self._handle_weight,
+            self.STATE_ONBOARDING_HEIGHT: self._handle_height,
+            self.STATE_ONBOARDING_AGE: self._handle_age,
+            self.STATE_ONBOARDING_DIET: self._handle_diet,
+            self.STATE_ONBOARDING_RESTRICTIONS: self._handle_restrictions,
+            self.STATE_ONBOARDING_ALLERGIES: self._handle_allergies,
+            self.STATE_ONBOARDING_ACTIVITY: self._handle_activity,
+            self.STATE_READY_FOR_PLAN: self._handle_ready_for_plan,
+            self.STATE_SHOWING_ROADMAP: self._handle_showing_roadmap,
+        }
 
-        self.conversations = self._load_conversations()
+        # Keyword matchers for free-text goal / activity answers
+        self._keyword_mappings = {"goal": self.GOALS, "activity": self.ACTIVITY_LEVELS}
+        # Exact-answer fast path: whole normalized reply -> key, precomputed
+        # with the full scan so it always agrees with it ("lose", "moderate")
+        self._keyword_indexes = {
+            kind: {
+                synonym: self._scan_keyword(synonym, mapping)
+                for synonyms in mapping.values()
+                for synonym in synonyms
+            }
+            for kind, mapping in self._keyword_mappings.items()
+        }
+        self._keyword_automata = None
+        if ahocorasick is not None:
+            self._keyword_automata = {
+                kind: self._build_automaton(mapping)
+                for kind, mapping in self._keyword_mappings.items()
+            }
 
         # Initialize Helpers
         self.nl_generator = NLGenerator()
@@ -121,111 +357,304 @@ class ConversationManager:
             print("WARNING: GEMINI_API_KEY not found in storage. Fallback deactivated.")
             self.gemini_model = None
 
-        # Initialize Models
-        print("[ConversationManager] Loading models...")
-        self.roadmap_generator = RoadmapGenerator(
-            model_path=os.path.join(root_dir, "RoadMap_model", "roadmap_model.pkl")
-        )
-        self.food_recommender = FoodRecommender(
-            database_path=os.path.join(
-                root_dir, "model_3_build", "model3_food_database.json"
-            )
-        )
+        # Models load on first use (see roadmap_generator / food_recommender):
+        # greeting and onboarding turns never touch them
         # Intent classifier optional for now as we drive with state machine
 
-    def _load_conversations(self) -> Dict:
-        """Load conversation states from disk."""
-        if os.path.exists(self.storage_path):
+    @functools.cached_property
+    def roadmap_generator(self) -> RoadmapGenerator:
+        return _shared_roadmap_generator()
+
+    @functools.cached_property
+    def food_recommender(self) -> FoodRecommender:
+        return _shared_food_recommender()
+
+    def _migrate_single_file_store(self):
+        """Split a single-file store (and its write-ahead log) into shards.
+
+        The legacy file ({user_id: conversation}) may be the same
+        data/user_profiles.json StateManager migrates ({user_id: profile}),
+        so it is left in place: only records with a "current_state" are
+        taken, users that already have a shard are skipped, and a marker in
+        the profiles dir records completion. The WAL is ours and is removed.
+        With persistence off the legacy store is only read into memory.
+        """
+        wal_path = self.storage_path + ".wal"
+        marker_path = os.path.join(self.profiles_dir, ".legacy_migrated")
+        read_legacy = os.path.exists(self.storage_path) and not os.path.exists(marker_path)
+        if not (read_legacy or os.path.exists(wal_path)):
+            return
+
+        conversations = {}
+        if read_legacy:
             try:
-                with open(self.storage_path, "r") as f:
-                    return json.load(f)
+                with open(self.storage_path, "rb") as f:
+                    conversations = _json_loads(f.read())
             except:
-                return {}
-        return {}
+                conversations = {}
+        if os.path.exists(wal_path):
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = _json_loads(line)
+                    except ValueError:
+                        break  # torn final record from an interrupted write
+                    conversations[record["uid"]] = record["conv"]
+
+        conversations = {
+            user_id: conv
+            for user_id, conv in conversations.items()
+            if isinstance(conv, dict)
+            and "current_state" in conv
+            and not os.path.exists(self._shard_path(user_id))
+        }
+        for conv in conversations.values():
+            self._share_vocabulary(self._upgrade_conversation(conv))
+        self.conversations.update(conversations)
+        self._resident.update(conversations)
+        if not self._persist:
+            # Read-only run: serve the legacy store from memory, leave it as is
+            self._evict_overflow()
+            return
+        self._dirty.update(conversations)
+        self._flush()
+        self._evict_overflow()
+
+        if read_legacy and not self._dirty:  # every shard written
+            os.makedirs(self.profiles_dir, exist_ok=True)
+            with open(marker_path, "wb"):
+                pass
+        if os.path.exists(wal_path) and not self._dirty:
+            os.remove(wal_path)
+
+    def _save_conversations(self, user_id: Optional[str] = None):
+        """Mark conversation state dirty and schedule a debounced flush."""
+        if not self._persist:
+            return
+        with self._save_lock:
+            self._dirty.add(user_id)
+            # One pending timer per window; later writes ride along with it
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(
+                    self.SAVE_DEBOUNCE_SECONDS, self._flush
+                )
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush(self):
+        """Rewrite the shards of users changed since the last flush."""
+        with self._save_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            if None in dirty:  # caller didn't say which user changed
+                dirty = set(self.conversations)
+                # Conversations deleted from the dict lose their shard too
+                for user_id in self._resident - dirty:
+                    self._resident.discard(user_id)
+                    if os.path.exists(self._shard_path(user_id)):
+                        os.remove(self._shard_path(user_id))
+
+            os.makedirs(self.profiles_dir, exist_ok=True)
+            for user_id in dirty:
+                if user_id in self.conversations:
+                    if not self._write_shard(user_id, self.conversations[user_id]):
+                        self._dirty.add(user_id)  # retried on the next flush
+
+    # Longest quoted id used as a file name as is; longer ones are hashed
+    MAX_SHARD_NAME = 200
+
+    def _shard_path(self, user_id: str) -> str:
+        name = quote(str(user_id), safe="")
+        if len(name) > self.MAX_SHARD_NAME:
+            name = name[:64] + "-" + hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.profiles_dir, name + ".json")
+
+    def has_user(self, user_id: str) -> bool:
+        """Whether the user has a conversation, in memory or on disk."""
+        return user_id in self.conversations or os.path.exists(self._shard_path(user_id))
+
+    def _write_shard(self, user_id: str, conv: Dict) -> bool:
+        """Atomically replace one user's shard; False (logged) if it failed."""
+        path = self._shard_path(user_id)
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(_json_dumps(conv))
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError):
+            logger.exception("could not save conversation for user %r", user_id)
+            return False
+        return True
+
+    def _load_shard(self, user_id: str) -> Optional[Dict]:
+        path = self._shard_path(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                conv = self._upgrade_conversation(_json_loads(f.read()))
+        except ValueError:
+            return None
+        return self._share_vocabulary(conv)
+
+    @staticmethod
+    def _upgrade_conversation(conv: Dict) -> Dict:
+        """Convert records written before last_interaction became an epoch float."""
+        if isinstance(conv.get("last_interaction"), str):
+            conv["last_interaction"] = datetime.fromisoformat(
+                conv["last_interaction"]
+            ).timestamp()
+        return conv
+
+    # Profile fields whose values come from a small fixed vocabulary
+    _VOCABULARY_FIELDS = ("gender", "activity_level", "fitness_goal")
+
+    @classmethod
+    def _share_vocabulary(cls, conv: Dict) -> Dict:
+        """
+        Intern enumerated values of a decoded conversation.
 
-    def _save_conversations(self):
-        """Persist conversation states to disk."""
-        os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
-        with open(self.storage_path, "w") as f:
-            json.dump(self.conversations, f, indent=2)
+        Decoding gives every resident user private copies of strings like
+        "onboarding_goal" or "weight_loss"; interning makes them share one
+        object, the way conversations created in-process already do.
+        """
+        if isinstance(conv.get("current_state"), str):
+            conv["current_state"] = sys.intern(conv["current_state"])
+        profile = conv.get("profile")
+        if isinstance(profile, dict):
+            for field in cls._VOCABULARY_FIELDS:
+                if isinstance(profile.get(field), str):
+                    profile[field] = sys.intern(profile[field])
+        return conv
+
+    def _evict_overflow(self):
+        """Drop least recently used conversations, writing back unsaved ones."""
+        if len(self.conversations) <= self.MAX_ACTIVE_CONVERSATIONS:
+            return
+        with self._save_lock:
+            os.makedirs(self.profiles_dir, exist_ok=True)
+            unsaved = []
+            while len(self.conversations) > self.MAX_ACTIVE_CONVERSATIONS:
+                user_id, conv = self.conversations.popitem(last=False)
+                self._resident.discard(user_id)
+                if user_id in self._dirty or None in self._dirty:
+                    self._dirty.discard(user_id)
+                    if not self._write_shard(user_id, conv):
+                        unsaved.append((user_id, conv))
+            # Keep conversations that failed to save resident (and dirty)
+            for user_id, conv in unsaved:
+                self.conversations[user_id] = conv
+                self.conversations.move_to_end(user_id, last=False)
+                self._resident.add(user_id)
+                self._dirty.add(user_id)
 
     def get_user_conversation(self, user_id: str) -> Dict:
         """Get or create user conversation state."""
+        if user_id not in self.conversations:
+            stored = self._load_shard(user_id)
+            if stored is not None:
+                self.conversations[user_id] = stored
+                self._resident.add(user_id)
+
         if user_id not in self.conversations:
             self.conversations[user_id] = {
                 "current_state": self.STATE_GREETING,
-                "profile": {
-                    "weight_kg": None,
-                    "height_cm": None,
-                    "age": None,
-                    "gender": "female",  # Defaulting to female if not collected, helps Model 2
-                    "activity_level": None,
-                    "fitness_goal": None,
-                    "current_week": 1,
-                    "dietary_restrictions": [],
-                },
-                "last_interaction": datetime.now().isoformat(),
+                "profile": {**self._NEW_PROFILE, "dietary_restrictions": []},
+                "last_interaction": time.time(),
                 "message_count": 0,
             }
-            self._save_conversations()
+            self._resident.add(user_id)
+            self._save_conversations(user_id)
+
+        self.conversations.move_to_end(user_id)
+        self._evict_overflow()
 
         # Stale check
-        last_time = datetime.fromisoformat(
-            self.conversations[user_id]["last_interaction"]
-        )
-        if datetime.now() - last_time > timedelta(days=7):
-            self.conversations[user_id]["current_state"] = self.STATE_GREETING
+        conv = self.conversations[user_id]
+        if time.time() - conv["last_interaction"] > self.STALE_AFTER_SECONDS:
+            conv["current_state"] = self.STATE_GREETING
 
         return self.conversations[user_id]
 
     def _extract_number(self, text: str) -> Optional[float]:
         """Extract numeric value - rejects word numbers like 'seventy'."""
         text = text.strip()
+        # Fast path for bare answers ("70", "172.5"): same value the regexes
+        # below would find, without running them
+        if text[:1].isdigit() and text.isascii() and text.replace(".", "", 1).isdigit():
+            return float(text)
         # Remove units but keep the number
-        text_clean = re.sub(
-            r"(kg|kilogram|kilograms|cm|centimeter|centimeters|years?|old)",
-            "",
-            text,
-            flags=re.IGNORECASE,
-        )
+        text_clean = _UNIT_RE.sub("", text)
         # Find first number (int or decimal)
-        match = re.search(r"(\d+\.?\d*)", text_clean)
+        match = _NUM_RE.search(text_clean)
         if match:
             return float(match.group(1))
         # Word numbers like "seventy" will return None -> triggers helpful error
         return None
 
+    _MSG_GEMINI_OFFLINE = "I'm not sure what you mean, and I can't connect to my brain right now. Let's stick to the plan!"
+    _MSG_GEMINI_ERROR = "I'm having trouble thinking right now. Let's get back to your fitness plan!"
+
     def _query_gemini(self, message: str, profile: Dict) -> str:
         """Fallback to Gemini API for general queries or unmatched intents."""
         if not self.gemini_model:
-            return "I'm not sure what you mean, and I can't connect to my brain right now. Let's stick to the plan!"
+            return self._MSG_GEMINI_OFFLINE
 
         try:
-            # Construct context from profile
-            context_parts = ["You are a helpful, encouraging AI diet and fitness coach."]
-            
-            if profile.get("fitness_goal"):
-                context_parts.append(f"The user's goal is to {profile['fitness_goal']}.")
-            
-            restrictions = profile.get("dietary_restrictions")
-            if restrictions:
-                 context_parts.append(f"They have the following dietary requirements: {restrictions}.")
-
-            if profile.get("age"):
-                 context_parts.append(f"They are {profile['age']} years old.")
-            
-            context_parts.append(f"User message: {message}")
-            context_parts.append("Provide a helpful, concise response relevant to fitness/diet. If the user asks something completely unrelated, politely bring it back to health. Do not ask for personal info if you don't need it.")
-
-            prompt = "\n".join(context_parts)
-            
-            response = self.gemini_model.generate_content(prompt)
+            response = self.gemini_model.generate_content(self._gemini_prompt(message, profile))
             if response and response.text:
                 return response.text
-            return "I'm having trouble thinking right now. Let's get back to your fitness plan!"
+            return self._MSG_GEMINI_ERROR
         except Exception as e:
             print(f"Gemini API Error: {e}")
-            return "I'm having trouble thinking right now. Let's get back to your fitness plan!"
+            return self._MSG_GEMINI_ERROR
+
+    def _query_gemini_stream(self, message: str, profile: Dict):
+        """_query_gemini, yielding the reply piece by piece as Gemini sends it."""
+        if not self.gemini_model:
+            yield self._MSG_GEMINI_OFFLINE
+            return
+
+        sent = False
+        try:
+            for piece in self.gemini_model.generate_content(
+                self._gemini_prompt(message, profile), stream=True
+            ):
+                if piece.text:
+                    sent = True
+                    yield piece.text
+        except Exception as e:
+            print(f"Gemini API Error: {e}")
+            if sent:
+                return  # keep the partial reply rather than append an apology
+        if not sent:
+            yield self._MSG_GEMINI_ERROR
+
+    @staticmethod
+    def _gemini_prompt(message: str, profile: Dict) -> str:
+        """Coaching prompt with the user's profile as context."""
+        # Construct context from profile
+        context_parts = ["You are a helpful, encouraging AI diet and fitness coach."]
+        
+        if profile.get("fitness_goal"):
+            context_parts.append(f"The user's goal is to {profile['fitness_goal']}.")
+        
+        restrictions = profile.get("dietary_restrictions")
+        if restrictions:
+             context_parts.append(f"They have the following dietary requirements: {restrictions}.")
+
+        if profile.get("age"):
+             context_parts.append(f"They are {profile['age']} years old.")
+        
+        context_parts.append(f"User message: {message}")
+        context_parts.append("Provide a helpful, concise response relevant to fitness/diet. If the user asks something completely unrelated, politely bring it back to health. Do not ask for personal info if you don't need it.")
+
+        return "\n".join(context_parts)
 
     def adapt_model2_to_model3(self, model2_output: Dict, user_profile: Dict) -> Dict:
         """
@@ -262,17 +691,67 @@ class ConversationManager:
 
     def process_message(self, user_id: str, message: str, profile_update: Dict = None) -> str:
         """Main handler for user messages."""
+        return self.process_messages(user_id, [message], profile_update)[0]
+
+    def process_messages(
+        self, user_id: str, messages: List[str], profile_update: Dict = None
+    ) -> List[str]:
+        """
+        Handle several messages from one user in order; returns every response.
+
+        Same as calling process_message for each, but the conversation is
+        looked up and checked for changes once for the whole batch.
+        """
+        conv, turn = self._begin_turn(user_id, profile_update)
+        try:
+            return [self._handle_state(conv, message) for message in messages]
+        finally:
+            self._end_turn(user_id, conv, turn)
+
+    def process_message_stream(self, user_id: str, message: str, profile_update: Dict = None):
+        """
+        Same as process_message, but yields the response as it is produced.
+
+        State-machine replies are ready at once and come as one chunk;
+        Gemini fallback replies are relayed piece by piece as they arrive.
+        """
+        conv, turn = self._begin_turn(user_id, profile_update)
+        try:
+            response = self._handle_state(conv, message, stream=True)
+            if isinstance(response, str):
+                yield response
+            else:
+                yield from response
+        finally:
+            self._end_turn(user_id, conv, turn)
+
+    def _begin_turn(self, user_id: str, profile_update: Optional[Dict]):
+        """Look up the conversation and snapshot it for _end_turn."""
         conv = self.get_user_conversation(user_id)
-        conv["last_interaction"] = datetime.now().isoformat()
+        now = time.time()
+        last_seen = conv["last_interaction"]
+        conv["last_interaction"] = now
+        # Profile snapshot in its persisted form: in-place edits to its lists
+        # (e.g. dietary_restrictions) must count as changes too
+        before = (conv["current_state"], _json_dumps(conv["profile"]), conv["message_count"])
 
         # Update profile if provided from frontend
         if profile_update:
             self._sync_profile(conv, profile_update)
-
-        response = self._handle_state(conv, message)
-
-        self._save_conversations()
-        return response
+        return conv, (before, now, last_seen)
+
+    def _end_turn(self, user_id: str, conv: Dict, turn: Tuple):
+        """Persist the conversation if the turn changed it."""
+        before, now, last_seen = turn
+        after = (conv["current_state"], _json_dumps(conv["profile"]), conv["message_count"])
+        if after != before:
+            self._save_conversations(user_id)
+            # A delivered plan is the result users come back for: persist now
+            if conv["current_state"] == self.STATE_SHOWING_ROADMAP:
+                self._flush()
+        elif now - last_seen >= self.LAST_SEEN_RESOLUTION_SECONDS:
+            # Nothing durable changed; only refresh a noticeably stale timestamp
+            self._save_conversations(user_id)
 
     def _sync_profile(self, conv: Dict, updates: Dict):
         """Sync frontend profile data to backend state."""
@@ -330,37 +809,27 @@ class ConversationManager:
                 else:
                     profile[be_key] = val
 
-    def _handle_state(self, conv: Dict, message: str) -> str:
+    def _handle_state(self, conv: Dict, message: str, stream: bool = False):
+        """Reply to one message; with stream=True a Gemini reply is an iterator of pieces."""
         state = conv["current_state"]
         profile = conv["profile"]
 
         msg_clean = message.strip().lower()
 
         # ✅ UNIVERSAL RESET HANDLER
-        if msg_clean in ["reset", "restart", "start over", "new", "new plan", "quit", "stop"]:
+        if msg_clean in self._RESET_COMMANDS:
             # Create fresh conversation state with clean profile
             conv["current_state"] = self.STATE_GREETING
-            conv["profile"] = {
-                "weight_kg": None,
-                "height_cm": None,
-                "age": None,
-                "gender": "female",
-                "activity_level": None,
-                "fitness_goal": None,
-                "current_week": 1,
-                "dietary_restrictions": "",
-                "allergens": [],
-            }
+            conv["profile"] = {**self._RESET_PROFILE, "allergens": []}
             conv["message_count"] = 0
-            if msg_clean in ["quit", "stop"]:
-                return "Conversation stopped and data cleared. How else can I help you today?"
-            return "Starting fresh! What's your new goal? (lose weight / gain muscle / maintain)"
+            if msg_clean in self._STOP_COMMANDS:
+                return self._MSG_STOPPED
+            return self._MSG_RESET
 
         # ✅ DIRECT PLAN REQUEST HANDLER
-        if any(keyword in msg_clean for keyword in ["diet plan", "show plan", "generate plan", "get plan"]) or msg_clean == "diet":
+        if any(keyword in msg_clean for keyword in self._PLAN_REQUEST_KEYWORDS) or msg_clean == "diet":
             # Check if profile is sufficient
-            required = ["weight_kg", "height_cm", "age", "activity_level", "fitness_goal"]
-            missing = [f for f in required if profile.get(f) is None]
+            missing = [f for f in self._PLAN_REQUIRED_FIELDS if profile.get(f) is None]
             
             if not missing:
                 conv["current_state"] = self.STATE_READY_FOR_PLAN
@@ -369,124 +838,157 @@ class ConversationManager:
                 # If incomplete, stay in current state but tell them why
                 return f"I'd love to give you a diet plan, but I need some more info first (missing: {', '.join(missing)}). Let's continue!"
 
-        # State: Greeting
-        if state == self.STATE_GREETING:
-            conv["current_state"] = self.STATE_ONBOARDING_GOAL
-            return "Hi! I'm your AI fitness coach. 😊 What's your goal today? (lose weight / gain muscle / maintain)"
-
-        # State: Goal
-        elif state == self.STATE_ONBOARDING_GOAL:
-            goal = self._match_keyword(message, self.GOALS)
-            if goal:
-                profile["fitness_goal"] = goal
-                conv["current_state"] = self.STATE_ONBOARDING_WEIGHT
-                return "Great goal! 💪 What's your current weight in kg?"
-            return "I didn't catch that. Please choose: lose weight, gain muscle, or maintain."
-
-        # State: Weight
-        elif state == self.STATE_ONBOARDING_WEIGHT:
-            weight = self._extract_number(message)
-            if weight and self.MIN_WEIGHT <= weight <= self.MAX_WEIGHT:
-                profile["weight_kg"] = weight
-                conv["current_state"] = self.STATE_ONBOARDING_HEIGHT
-                return f"✅ {weight} kg logged. Height in cm?"
-            elif weight is None:
-                return "I need a number like '70' (not 'seventy'). What's your weight in kg?"
-            else:
-                return f"That weight seems unusual ({weight} kg). Please enter a realistic weight (40-200 kg)."
-
-        # State: Height
-        elif state == self.STATE_ONBOARDING_HEIGHT:
-            height = self._extract_number(message)
-            if height and self.MIN_HEIGHT <= height <= self.MAX_HEIGHT:
-                profile["height_cm"] = height
-                conv["current_state"] = self.STATE_ONBOARDING_AGE
-                return f"{height} cm — perfect. How old are you?"
-            elif height is None:
-                return "I need a number like '170' (not 'one seventy'). What's your height in cm?"
-            else:
-                return f"That height seems unusual ({height} cm). Please enter a realistic height (100-250 cm)."
-
-        # State: Age
-        elif state == self.STATE_ONBOARDING_AGE:
-            age = self._extract_number(message)
-            if age and self.MIN_AGE <= age <= self.MAX_AGE:
-                profile["age"] = int(age)
-                # CHANGE: We now go to DIET instead of ACTIVITY
-                conv["current_state"] = self.STATE_ONBOARDING_DIET 
-                return f"{int(age)} years young! 🥗 Are you veg or non-veg?"
-            elif age is None:
-                return "I need a number like '25'. How old are you?"
-            else:
-                return f"Please enter a realistic age (13-100 years)."
-        # State: Diet (The New Question)
-        elif state == self.STATE_ONBOARDING_DIET:
-            msg_clean = message.lower().strip()
-            if any(word in msg_clean for word in ["veg", "vegetarian", "vegan"]):
-                profile["dietary_restrictions"] = "vegetarian" # Store as string for flexibility
-                conv["current_state"] = self.STATE_ONBOARDING_RESTRICTIONS
-                return "Noted! 🥦 Any other dietary restrictions? (e.g., Low carb, Halal, No red meat, or 'None')"
-            elif "non" in msg_clean:
-                profile["dietary_restrictions"] = "" # No restrictions for non-veg
-                conv["current_state"] = self.STATE_ONBOARDING_RESTRICTIONS
-                return "Got it! 🍗 Any other dietary restrictions? (e.g., Low carb, Halal, No red meat, or 'None')"
-            else:
-                return "Please specify: Are you veg or non-veg?"
-
-        # State: Restrictions
-        elif state == self.STATE_ONBOARDING_RESTRICTIONS:
-            if msg_clean in ["none", "no", "nothing", "na"]:
-                # Keep existing if it was 'vegetarian'
-                if profile.get("dietary_restrictions") != "vegetarian":
-                    profile["dietary_restrictions"] = ""
-            else:
-                # Append or set
-                existing = profile.get("dietary_restrictions", "")
-                if existing:
-                    profile["dietary_restrictions"] = f"{existing}, {message}"
-                else:
-                    profile["dietary_restrictions"] = message
-            
-            conv["current_state"] = self.STATE_ONBOARDING_ALLERGIES
-            return "Almost there! Any known allergies? (Dairy, Eggs, Fish, Gluten, Wheat, Soy, Tree Nuts, Peanuts, or 'None')"
+        handler = self._state_handlers.get(state)
+        if handler is None:
+            # Fallback to Gemini
+            if stream:
+                return self._query_gemini_stream(message, profile)
+            return self._query_gemini(message, profile)
+        return handler(conv, message, msg_clean)
+
+    # State: Greeting
+    def _handle_greeting(self, conv: Dict, message: str, msg_clean: str) -> str:
+        conv["current_state"] = self.STATE_ONBOARDING_GOAL
+        return self._MSG_GREETING
+
+    # State: Goal
+    def _handle_goal(self, conv: Dict, message: str, msg_clean: str) -> str:
+        goal = self._match_keyword(message, "goal")
+        if goal:
+            conv["profile"]["fitness_goal"] = goal
+            conv["current_state"] = self.STATE_ONBOARDING_WEIGHT
+            return self._MSG_GOAL_SET
+        return self._MSG_GOAL_RETRY
+
+    # State: Weight
+    def _handle_weight(self, conv: Dict, message: str, msg_clean: str) -> str:
+        weight = self._extract_number(message)
+        if weight and self.MIN_WEIGHT <= weight <= self.MAX_WEIGHT:
+            conv["profile"]["weight_kg"] = weight
+            conv["current_state"] = self.STATE_ONBOARDING_HEIGHT
+            return f"✅ {weight} kg logged. Height in cm?"
+        elif weight is None:
+            return self._MSG_WEIGHT_RETRY
+        else:
+            return f"That weight seems unusual ({weight} kg). Please enter a realistic weight (40-200 kg)."
+
+    # State: Height
+    def _handle_height(self, conv: Dict, message: str, msg_clean: str) -> str:
+        height = self._extract_number(message)
+        if height and self.MIN_HEIGHT <= height <= self.MAX_HEIGHT:
+            conv["profile"]["height_cm"] = height
+            conv["current_state"] = self.STATE_ONBOARDING_AGE
+            return f"{height} cm — perfect. How old are you?"
+        elif height is None:
+            return self._MSG_HEIGHT_RETRY
+        else:
+            return f"That height seems unusual ({height} cm). Please enter a realistic height (100-250 cm)."
+
+    # State: Age
+    def _handle_age(self, conv: Dict, message: str, msg_clean: str) -> str:
+        age = self._extract_number(message)
+        if age and self.MIN_AGE <= age <= self.MAX_AGE:
+            conv["profile"]["age"] = int(age)
+            # CHANGE: We now go to DIET instead of ACTIVITY
+            conv["current_state"] = self.STATE_ONBOARDING_DIET
+            return f"{int(age)} years young! 🥗 Are you veg or non-veg?"
+        elif age is None:
+            return self._MSG_AGE_RETRY
+        else:
+            return self._MSG_AGE_RANGE
 
-        # State: Allergies
-        elif state == self.STATE_ONBOARDING_ALLERGIES:
-            if msg_clean in ["none", "no", "nothing", "na"]:
-                profile["allergens"] = []
-            else:
-                # Basic matching for standard allergens
-                found = [a for a in self.STANDARD_ALLERGENS if a in msg_clean]
-                profile["allergens"] = found if found else [message] # Fallback to raw string
-            
-            conv["current_state"] = self.STATE_ONBOARDING_ACTIVITY
-            return "Last question! What's your activity level? (sedentary/light/moderate/active)"
-            
-        # State: Activity (Final Step)
-        elif state == self.STATE_ONBOARDING_ACTIVITY:
-            activity = self._match_keyword(message, self.ACTIVITY_LEVELS)
-            if activity:
-                profile["activity_level"] = activity
-                conv["current_state"] = self.STATE_READY_FOR_PLAN
-                # Trigger generation immediately
-                return self._generate_plan(conv)
-            return f"Please choose: {', '.join(self.ACTIVITY_LEVELS)}"
+    # State: Diet (The New Question)
+    def _handle_diet(self, conv: Dict, message: str, msg_clean: str) -> str:
+        profile = conv["profile"]
+        if any(word in msg_clean for word in ["veg", "vegetarian", "vegan"]):
+            profile["dietary_restrictions"] = "vegetarian" # Store as string for flexibility
+            conv["current_state"] = self.STATE_ONBOARDING_RESTRICTIONS
+            return self._MSG_VEG_SET
+        elif "non" in msg_clean:
+            profile["dietary_restrictions"] = "" # No restrictions for non-veg
+            conv["current_state"] = self.STATE_ONBOARDING_RESTRICTIONS
+            return self._MSG_NON_VEG_SET
+        else:
+            return self._MSG_DIET_RETRY
 
-        # State: Ready for Plan (Auto-generate on any input)
-        elif state == self.STATE_READY_FOR_PLAN:
-            return self._generate_plan(conv)
+    # State: Restrictions
+    def _handle_restrictions(self, conv: Dict, message: str, msg_clean: str) -> str:
+        profile = conv["profile"]
+        if msg_clean in self._NONE_REPLIES:
+            # Keep existing if it was 'vegetarian'
+            if profile.get("dietary_restrictions") != "vegetarian":
+                profile["dietary_restrictions"] = ""
+        else:
+            # Append or set
+            existing = profile.get("dietary_restrictions", "")
+            if existing:
+                profile["dietary_restrictions"] = f"{existing}, {message}"
+            else:
+                profile["dietary_restrictions"] = message
 
-        # State: Showing Roadmap (Maintenance mode)
-        elif state == self.STATE_SHOWING_ROADMAP:
-            # Simple handling for follow-ups
-            return "I've designed this plan for you. Type 'reset' to start over or let me know if you need adjustments!"
+        conv["current_state"] = self.STATE_ONBOARDING_ALLERGIES
+        return self._MSG_ALLERGIES
 
+    # State: Allergies
+    def _handle_allergies(self, conv: Dict, message: str, msg_clean: str) -> str:
+        profile = conv["profile"]
+        if msg_clean in self._NONE_REPLIES:
+            profile["allergens"] = []
         else:
-            # Fallback to Gemini
-            return self._query_gemini(message, profile)
-
-    def _match_keyword(self, text: str, mapping: Dict) -> Optional[str]:
+            # Basic matching for standard allergens
+            found = [a for a in self.STANDARD_ALLERGENS if a in msg_clean]
+            profile["allergens"] = found if found else [message] # Fallback to raw string
+
+        conv["current_state"] = self.STATE_ONBOARDING_ACTIVITY
+        return self._MSG_ACTIVITY
+
+    # State: Activity (Final Step)
+    def _handle_activity(self, conv: Dict, message: str, msg_clean: str) -> str:
+        activity = self._match_keyword(message, "activity")
+        if activity:
+            conv["profile"]["activity_level"] = activity
+            conv["current_state"] = self.STATE_READY_FOR_PLAN
+            # Trigger generation immediately
+            return self._generate_plan(conv)
+        return self._MSG_ACTIVITY_RETRY
+
+    # State: Ready for Plan (Auto-generate on any input)
+    def _handle_ready_for_plan(self, conv: Dict, message: str, msg_clean: str) -> str:
+        return self._generate_plan(conv)
+
+    # State: Showing Roadmap (Maintenance mode)
+    def _handle_showing_roadmap(self, conv: Dict, message: str, msg_clean: str) -> str:
+        # Simple handling for follow-ups
+        return self._MSG_SHOWING_ROADMAP
+
+    @staticmethod
+    def _build_automaton(mapping: Dict):
+        """Aho-Corasick automaton mapping each synonym to its key's position."""
+        automaton = ahocorasick.Automaton()
+        ranks = {}
+        for rank, synonyms in enumerate(mapping.values()):
+            for synonym in synonyms:
+                # Shared synonyms ("active") resolve to the earliest key
+                ranks.setdefault(synonym, rank)
+        for synonym, rank in ranks.items():
+            automaton.add_word(synonym, rank)
+        automaton.make_automaton()
+        return automaton
+
+    def _match_keyword(self, text: str, kind: str) -> Optional[str]:
+        """Return the first key (in mapping order) with a synonym in text."""
         text = text.lower()
+        hit = self._keyword_indexes[kind].get(text.strip())
+        if hit is not None:
+            return hit
+        mapping = self._keyword_mappings[kind]
+        if self._keyword_automata is not None:
+            ranks = [rank for _, rank in self._keyword_automata[kind].iter(text)]
+            return list(mapping)[min(ranks)] if ranks else None
+        return self._scan_keyword(text, mapping)
+
+    @staticmethod
+    def _scan_keyword(text: str, mapping: Dict) -> Optional[str]:
         for key, synonyms in mapping.items():
             if any(s in text for s in synonyms):
                 return key
@@ -497,14 +999,7 @@ class ConversationManager:
         profile = conv["profile"]
 
         # VALIDATION: Ensure complete profile before generation
-        required_fields = [
-            "weight_kg",
-            "height_cm",
-            "age",
-            "activity_level",
-            "fitness_goal",
-        ]
-        missing = [f for f in required_fields if profile.get(f) is None]
+        missing = [f for f in self._PLAN_REQUIRED_FIELDS if profile.get(f) is None]
         if missing:
             return f" Let's complete your profile first! Missing: {', '.join(missing)}"
 
@@ -563,16 +1058,15 @@ class ConversationManager:
             # 5. NLG
             current_week = profile.get("current_week", 1)
             response = self.nl_generator.format_plan_response(
-                profile, roadmap, meal_plan, current_week
+                profile, roadmap, meal_plan, current_week,
+                daily_summary=meal_result.get("daily_summary"),
             )
 
             conv["current_state"] = self.STATE_SHOWING_ROADMAP
             return response
 
         except Exception as e:
-            import traceback
-
-            traceback.print_exc()
+            logger.exception("plan generation failed")
             return f"⚠️ System Error: {str(e)}"
 
 
@@ -3,9 +3,14 @@ Intent Classifier Wrapper: Model 1
 Wraps the pre-trained TF-IDF + Classifier model for intent classification.
 """
 
+import functools
+import mmap
 import pickle
 import os
-from typing import Optional
+from typing import List, Optional
+
+import numpy as np
+import scipy.sparse as sp
 
 
 class IntentClassifier:
@@ -13,6 +18,9 @@ class IntentClassifier:
     Wrapper for Model 1: Intent Classification using TF-IDF + trained classifier.
     Classifies user messages into predefined intents.
     """
+
+    # Distinct messages remembered per classifier ("hi", "yes", one-word answers)
+    CACHE_SIZE = 4096
     
     def __init__(self, model_path: str, vectorizer_path: Optional[str] = None):
         """
@@ -34,14 +42,104 @@ class IntentClassifier:
         # Load models
         self.model = self._load_model(model_path)
         self.vectorizer = self._load_model(vectorizer_path)
+        self._rbf = self._compile_rbf_svc(self.model)
+
+        # Per-instance memo of repeated messages. Keys are only stripped, not
+        # lowercased: the vectorizer is case-sensitive (lowercase=False)
+        self._predict_cached = functools.lru_cache(maxsize=self.CACHE_SIZE)(
+            self._predict_uncached
+        )
+        self._predict_with_confidence_cached = functools.lru_cache(
+            maxsize=self.CACHE_SIZE
+        )(self._predict_with_confidence_uncached)
     
     def _load_model(self, path: str):
         """Load pickled model."""
         if not os.path.exists(path):
             raise FileNotFoundError(f"Model file not found: {path}")
         
+        # Unpickle straight from the page cache instead of through many
+        # small buffered read() calls
         with open(path, 'rb') as f:
-            return pickle.load(f)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return pickle.loads(buf)
+
+    @staticmethod
+    def _compile_rbf_svc(model):
+        """
+        Precompute float32 arrays for evaluating an RBF SVC's one-vs-one vote.
+
+        libsvm walks the support vectors one sparse row at a time in float64;
+        doing the kernel as one sparse product plus two dense float32 matmuls
+        gives the same votes in roughly half the time per message.
+
+        Returns:
+            Tuple of precomputed arrays, or None if the model is not an RBF SVC
+            (or the compiled vote disagrees with model.predict)
+        """
+        if type(model).__name__ != "SVC" or model.kernel != "rbf":
+            return None
+        if getattr(model, "break_ties", False) or not hasattr(model, "_gamma"):
+            return None
+        if not hasattr(model, "_dual_coef_"):
+            return None
+
+        support_vectors = sp.csr_matrix(model.support_vectors_)
+        # libsvm's own signs, matching _intercept_; for binary models sklearn
+        # negates the public dual_coef_/intercept_ but not these
+        dual_coef = model._dual_coef_
+        dual_coef = dual_coef.toarray() if sp.issparse(dual_coef) else dual_coef
+
+        # Pair (i, j): class-i SVs weigh in with dual_coef[j-1], class-j with dual_coef[i]
+        starts = np.concatenate([[0], np.cumsum(model.n_support_)])
+        n_classes = len(model.classes_)
+        pairs = [(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)]
+        weights = np.zeros((support_vectors.shape[0], len(pairs)), np.float32)
+        for p, (i, j) in enumerate(pairs):
+            weights[starts[i]:starts[i + 1], p] = dual_coef[j - 1, starts[i]:starts[i + 1]]
+            weights[starts[j]:starts[j + 1], p] = dual_coef[i, starts[j]:starts[j + 1]]
+
+        rbf = (
+            support_vectors.T.tocsr().astype(np.float32),
+            np.asarray(support_vectors.multiply(support_vectors).sum(axis=1), np.float32).ravel(),
+            np.float32(model._gamma),
+            weights,
+            model._intercept_.astype(np.float32),
+            np.array([i for i, _ in pairs]),
+            np.array([j for _, j in pairs]),
+        )
+
+        # Sanity check on the support vectors themselves: any sign or layout
+        # mismatch with sklearn shows up here, so fall back instead
+        sample = support_vectors[:: max(1, support_vectors.shape[0] // 64)]
+        expected = model.predict(sample if model._sparse else sample.toarray())
+        if not np.array_equal(IntentClassifier._rbf_vote(rbf, model.classes_, sample), expected):
+            return None
+        return rbf
+
+    def _predict_features(self, features):
+        """Predict intents for already-vectorized messages."""
+        if self._rbf is None:
+            return self.model.predict(features)
+        return self._rbf_vote(self._rbf, self.model.classes_, features)
+
+    @staticmethod
+    def _rbf_vote(rbf, classes, features):
+        """One-vs-one vote of a compiled RBF SVC (see _compile_rbf_svc)."""
+        sv_t, sv_sq, gamma, weights, intercept, first, second = rbf
+        features = features.astype(np.float32)
+        x_sq = np.asarray(features.multiply(features).sum(axis=1)).ravel()
+        # ||x - sv||^2 = ||x||^2 + ||sv||^2 - 2 x.sv
+        dist = x_sq[:, None] + sv_sq[None, :] - 2 * (features @ sv_t).toarray()
+        kernel = np.exp(-gamma * np.maximum(dist, 0))
+        decision = kernel @ weights + intercept
+
+        # libsvm votes for i when the pair's decision value is > 0; argmax
+        # keeps its lowest-index tie break
+        winners = np.where(decision > 0, first, second)
+        votes = np.zeros((features.shape[0], len(classes)), np.int32)
+        np.add.at(votes, (np.repeat(np.arange(features.shape[0]), len(first)), winners.ravel()), 1)
+        return classes[votes.argmax(axis=1)]
     
     def predict(self, user_message: str) -> str:
         """
@@ -53,14 +151,33 @@ class IntentClassifier:
         Returns:
             Predicted intent (e.g., 'weight_loss_plan', 'diet_suggestion')
         """
+        return self._predict_cached(user_message.strip())
+
+    def _predict_uncached(self, user_message: str) -> str:
         # Vectorize input
         features = self.vectorizer.transform([user_message])
         
         # Predict intent
-        intent = self.model.predict(features)[0]
+        intent = self._predict_features(features)[0]
         
         return intent
     
+    def predict_batch(self, user_messages: List[str]) -> List[str]:
+        """
+        Classify many messages with a single vectorizer/model call.
+
+        Args:
+            user_messages: Raw user text inputs (e.g. a test set or log replay)
+
+        Returns:
+            Predicted intents, in input order
+        """
+        messages = [message.strip() for message in user_messages]
+        unique = list(dict.fromkeys(messages))
+        features = self.vectorizer.transform(unique)
+        intents = dict(zip(unique, self._predict_features(features)))
+        return [intents[message] for message in messages]
+
     def predict_with_confidence(self, user_message: str) -> tuple:
         """
         Classify with confidence scores (if model supports predict_proba).
@@ -71,6 +188,9 @@ class IntentClassifier:
         Returns:
             Tuple of (intent, confidence_score)
         """
+        return self._predict_with_confidence_cached(user_message.strip())
+
+    def _predict_with_confidence_uncached(self, user_message: str) -> tuple:
         features = self.vectorizer.transform([user_message])
         
         # Check if model supports probability prediction
@@ -81,7 +201,7 @@ class IntentClassifier:
             return intent, confidence
         else:
             # Fallback to regular prediction
-            intent = self.model.predict(features)[0]
+            intent = self._predict_features(features)[0]
             return intent, 1.0
 
 
@@ -107,8 +227,8 @@ if __name__ == "__main__":
         ]
         
         print("\n[Testing Intent Classification]\n")
-        for msg in test_messages:
-            intent = classifier.predict(msg)
+        intents = classifier.predict_batch(test_messages)
+        for msg, intent in zip(test_messages, intents):
             print(f"Message: \"{msg}\"")
             print(f"Intent:  {intent}")
             
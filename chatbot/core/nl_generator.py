@@ -3,14 +3,15 @@ Natural Language Generator: Human-First Response Formatter
 Transforms technical data into coach-like, empathetic, and scannable responses.
 """
 
-from typing import Dict
+from typing import Dict, List, Optional
 
 class NLGenerator:
     """
     Generates human-friendly, formatted responses for the fitness chatbot.
     """
 
-    def format_plan_response(self, profile: Dict, roadmap: Dict, meal_plan: Dict, week: int) -> str:
+    def format_plan_response(self, profile: Dict, roadmap: Dict, meal_plan: Dict, week: int,
+                             daily_summary: Optional[Dict] = None) -> str:
         """
         Create a rich, structured response for the generated plan.
         
@@ -19,6 +20,7 @@ class NLGenerator:
             roadmap: Model 2 output (calories, exercise duration)
             meal_plan: Model 3 output (meals)
             week: Current week number
+            daily_summary: Model 3 daily totals (calories, protein_g), if already computed
             
         Returns:
             Formatted string response
@@ -35,18 +37,21 @@ class NLGenerator:
         weight = profile.get('weight_kg', '??')
         height = profile.get('height_cm', '??')
         
-        # Calculate daily totals from meal plan
-        daily_cals = 0
-        daily_protein = 0
-        
-        for meal_name in ['breakfast', 'lunch', 'dinner', 'snack']:
-            if meal_name in meal_plan:
-                meal = meal_plan[meal_name]
-                daily_cals += meal.get('total_calories', 0)
-                daily_protein += meal.get('total_protein_g', 0)
+        # Daily totals: reuse Model 3's summary, else sum the meal plan
+        if daily_summary:
+            daily_cals = daily_summary.get('calories', 0)
+            daily_protein = daily_summary.get('protein_g', 0)
+        else:
+            daily_cals = 0
+            daily_protein = 0
+            for meal_name in ['breakfast', 'lunch', 'dinner', 'snack']:
+                if meal_name in meal_plan:
+                    meal = meal_plan[meal_name]
+                    daily_cals += meal.get('total_calories', 0)
+                    daily_protein += meal.get('total_protein_g', 0)
         
-        # Build response
-        response = f"(Based on YOUR {weight}kg/{height}cm profile) Below is your diet plan.\n\n"
+        # Build response as a list of fragments, joined once at the end
+        parts = [f"(Based on YOUR {weight}kg/{height}cm profile) Below is your diet plan.\n\n"]
         
         # Format each meal
         meals_config = [
@@ -59,52 +64,50 @@ class NLGenerator:
         for meal_key, emoji_meal, title in meals_config:
             if meal_key in meal_plan:
                 meal = meal_plan[meal_key]
-                response += f"**{title}**\n"
-                response += self._format_meal(meal)
-                response += "\n\n"
+                parts.append(f"**{title}**\n")
+                self._format_meal(meal, parts)
+                parts.append("\n\n")
         
         # Daily summary
         target_cals = roadmap.get('target_calories', 0)
         exercise_mins = roadmap.get('target_exercise_minutes', 150)
         
-        response += f"**Daily Totals**\n"
-        response += f"\u2022 Calories: {daily_cals:.0f} kcal | Protein: {daily_protein:.0f}g\n"
-        response += f"\u2022 Exercise: {exercise_mins} mins/day\n\n"
+        parts.append(f"**Daily Totals**\n")
+        parts.append(f"\u2022 Calories: {daily_cals:.0f} kcal | Protein: {daily_protein:.0f}g\n")
+        parts.append(f"\u2022 Exercise: {exercise_mins} mins/day\n\n")
         
         # Pro tip based on goal
-        response += "**Pro Tip**: "
+        parts.append("**Pro Tip**: ")
         if profile.get('fitness_goal') == 'weight_loss':
-            response += "Drink water 30 mins before meals to feel fuller faster!\n\n"
+            parts.append("Drink water 30 mins before meals to feel fuller faster!\n\n")
         elif profile.get('fitness_goal') == 'muscle_gain':
-            response += "Don't skip the post-workout meal to fuel muscle growth!\n\n"
+            parts.append("Don't skip the post-workout meal to fuel muscle growth!\n\n")
         else:
-            response += "Consistency is key \u2014 you're doing great!\n\n"
+            parts.append("Consistency is key \u2014 you're doing great!\n\n")
         
-        response += "Type reset to start a new diet plan."
+        parts.append("Type reset to start a new diet plan.")
         
-        return response
+        return "".join(parts)
 
-    def _format_meal(self, meal: Dict) -> str:
-        """Format individual meal details."""
+    def _format_meal(self, meal: Dict, parts: List[str]):
+        """Append individual meal details to the caller's response parts."""
         if not meal or "foods" not in meal:
-            return "\u2022 *No recommendation*\n"
+            parts.append("\u2022 *No recommendation*\n")
+            return
         
-        lines = []
         # Show up to 3 foods, then summarize
         for food in meal["foods"][:3]:
             portion = food.get('portion_g', 0)
             name = food.get('name', 'Unknown')
-            lines.append(f"\u2192 {portion:.0f}g {name}")
+            parts.append(f"\u2192 {portion:.0f}g {name}\n")
         
         if len(meal["foods"]) > 3:
-            lines.append(f"\u2192 +{len(meal['foods'])-3} more items")
+            parts.append(f"\u2192 +{len(meal['foods'])-3} more items\n")
         
         # Meal totals
         meal_cals = meal.get('total_calories', 0)
         meal_protein = meal.get('total_protein_g', 0)
-        lines.append(f"_Total: {meal_cals:.0f} kcal | {meal_protein:.0f}g protein_")
-        
-        return "\n".join(lines)
+        parts.append(f"_Total: {meal_cals:.0f} kcal | {meal_protein:.0f}g protein_")
 
     def format_onboarding_error(self, error_type: str, context: str) -> str:
         """Format error messages naturally (fallback - specific errors now inline)."""
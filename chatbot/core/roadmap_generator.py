@@ -3,10 +3,32 @@ Roadmap Generator Wrapper: Model 2
 Wraps the pre-trained Random Forest model for personalized roadmap generation.
 """
 
+import functools
+import hashlib
+import logging
+import mmap
 import pickle
 import os
+import threading
 import numpy as np
-from typing import Dict
+from typing import Dict, List, Tuple
+
+try:
+    import onnxruntime
+except ImportError:  # predictions fall back to the sklearn forests
+    onnxruntime = None
+
+try:
+    import onnx
+    from onnx import helper, numpy_helper
+except ImportError:  # only cached .onnx exports can be used
+    onnx = None
+
+logger = logging.getLogger(__name__)
+
+# Generators already built in this process, keyed by absolute model path
+_INSTANCES: Dict[str, "RoadmapGenerator"] = {}
+_INSTANCES_LOCK = threading.Lock()
 
 
 class RoadmapGenerator:
@@ -38,6 +60,44 @@ class RoadmapGenerator:
     # Gender encoding (must match training)
     GENDER_ENCODING = {"male": 0, "female": 1, "other": 2}
 
+    # One-hot feature slots (sedentary, light, moderate, active); very_active
+    # shares the 'active' column. Unknown values encode as all zeros
+    _ACTIVITY_ONEHOT = {
+        "sedentary": (1, 0, 0, 0),
+        "light": (0, 1, 0, 0),
+        "moderate": (0, 0, 1, 0),
+        "active": (0, 0, 0, 1),
+        "very_active": (0, 0, 0, 1),
+    }
+    _NO_ACTIVITY = (0, 0, 0, 0)
+
+    # One-hot feature slots (weight_loss, muscle_gain, maintenance)
+    _GOAL_ONEHOT = {
+        "weight_loss": (1, 0, 0),
+        "muscle_gain": (0, 1, 0),
+        "maintenance": (0, 0, 1),
+    }
+    _NO_GOAL = (0, 0, 0)
+
+    # Batch encoding gathers one-hot rows by code; code -1 (unknown value)
+    # picks the trailing all-zero row
+    _ACTIVITY_CODE = {level: i for i, level in enumerate(_ACTIVITY_ONEHOT)}
+    _ACTIVITY_ROWS = np.array([*_ACTIVITY_ONEHOT.values(), _NO_ACTIVITY], dtype=np.float32)
+    _GOAL_CODE = {goal: i for i, goal in enumerate(_GOAL_ONEHOT)}
+    _GOAL_ROWS = np.array([*_GOAL_ONEHOT.values(), _NO_GOAL], dtype=np.float32)
+
+    # Estimated initial weekly exercise minutes per activity level
+    _EXERCISE_MAP = {
+        "sedentary": 30,
+        "light": 120,
+        "moderate": 180,
+        "active": 300,
+        "very_active": 420,
+    }
+
+    # Sub-models of the dict format, in (weight, calories, exercise) order
+    TARGETS = ("weight_kg", "calories", "exercise_minutes")
+
     def __init__(self, model_path: str):
         """
         Initialize Roadmap Generator.
@@ -45,16 +105,52 @@ class RoadmapGenerator:
         Args:
             model_path: Path to trained Random Forest model (.pkl)
         """
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
         self.model_path = model_path
-        self.model = self._load_model(model_path)
+        # The forests are unpickled on first use; with fresh ONNX exports
+        # on disk they are never needed at all
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._sessions = self._load_onnx_sessions()
+        # Per-thread (1, 14) feature buffers reused across predict() calls
+        self._local = threading.local()
+
+    @property
+    def model(self):
+        """Pickled model, loaded on first access."""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load_model(self.model_path)
+        return self._model
+
+    @classmethod
+    def get(cls, model_path: str) -> "RoadmapGenerator":
+        """
+        Shared generator for a model file, built on first request.
+
+        Args:
+            model_path: Path to trained Random Forest model (.pkl)
+        """
+        key = os.path.abspath(model_path)
+        generator = _INSTANCES.get(key)
+        if generator is None:
+            with _INSTANCES_LOCK:
+                generator = _INSTANCES.get(key)
+                if generator is None:
+                    generator = _INSTANCES[key] = cls(model_path)
+        return generator
 
     def _load_model(self, path: str):
         """Load pickled model."""
         if not os.path.exists(path):
             raise FileNotFoundError(f"Model file not found: {path}")
 
+        # Unpickle straight from the page cache instead of a read() copy
         with open(path, "rb") as f:
-            loaded = pickle.load(f)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                loaded = pickle.loads(buf)
 
         # Handle different model formats
         if isinstance(loaded, dict):
@@ -71,6 +167,135 @@ class RoadmapGenerator:
             self.model_dict = None
             return loaded
 
+    # Converted forests are cached per user, never next to the shipped model
+    ONNX_CACHE_DIR = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+        "fitness_chatbot",
+    )
+
+    def _onnx_path(self, target: str) -> str:
+        # Source path in the name keeps checkouts of the same model apart
+        source = hashlib.blake2b(os.path.abspath(self.model_path).encode(), digest_size=8).hexdigest()
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(self.ONNX_CACHE_DIR, f"{stem}-{source}.{target}.leaves.onnx")
+
+    @staticmethod
+    def _forest_to_onnx(forest) -> bytes:
+        """
+        Export a RandomForestRegressor as an ONNX leaf-finder.
+
+        ONNX Runtime's tree ensemble sums leaf values in float32, which moves
+        some predictions across an int()/round() boundary. So the graph only
+        walks the trees: output 'leaves' holds each tree's leaf (as an index
+        into the flat float64 node table that output 'values' carries), and
+        the averaging is done in float64 in the same order as sklearn.
+        """
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        attrs = {name: [] for name in (
+            "nodes_treeids", "nodes_nodeids", "nodes_featureids", "nodes_values",
+            "nodes_modes", "nodes_truenodeids", "nodes_falsenodeids",
+            "target_treeids", "target_nodeids", "target_ids", "target_weights",
+        )}
+        for tree_id, tree in enumerate(trees):
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            # sklearn tests float32 x <= float64 threshold; the largest
+            # float32 not above the threshold gives the same split
+            thresholds = tree.threshold.astype(np.float32)
+            thresholds = np.where(
+                thresholds > tree.threshold, np.nextafter(thresholds, np.float32(-np.inf)), thresholds
+            )
+            attrs["nodes_treeids"] += [tree_id] * tree.node_count
+            attrs["nodes_nodeids"] += node_ids.tolist()
+            attrs["nodes_featureids"] += np.where(is_leaf, 0, tree.feature).tolist()
+            attrs["nodes_values"] += np.where(is_leaf, 0, thresholds).tolist()
+            attrs["nodes_modes"] += ["LEAF" if leaf else "BRANCH_LEQ" for leaf in is_leaf]
+            attrs["nodes_truenodeids"] += np.where(is_leaf, 0, tree.children_left).tolist()
+            attrs["nodes_falsenodeids"] += np.where(is_leaf, 0, tree.children_right).tolist()
+            leaves = node_ids[is_leaf]
+            attrs["target_treeids"] += [tree_id] * len(leaves)
+            attrs["target_nodeids"] += leaves.tolist()
+            attrs["target_ids"] += [tree_id] * len(leaves)
+            attrs["target_weights"] += (leaves + offsets[tree_id]).astype(float).tolist()
+
+        values = np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64)
+        graph = helper.make_graph(
+            [
+                helper.make_node(
+                    "TreeEnsembleRegressor", ["X"], ["leaves"], domain="ai.onnx.ml",
+                    n_targets=len(trees), post_transform="NONE", aggregate_function="SUM",
+                    **attrs,
+                ),
+                helper.make_node("Constant", [], ["values"], value=numpy_helper.from_array(values)),
+            ],
+            "roadmap_forest",
+            [helper.make_tensor_value_info("X", onnx.TensorProto.FLOAT, [None, 14])],
+            [
+                helper.make_tensor_value_info("leaves", onnx.TensorProto.FLOAT, [None, len(trees)]),
+                helper.make_tensor_value_info("values", onnx.TensorProto.DOUBLE, [len(values)]),
+            ],
+        )
+        model = helper.make_model(
+            graph, opset_imports=[helper.make_opsetid("", 17), helper.make_opsetid("ai.onnx.ml", 1)]
+        )
+        model.ir_version = 8
+        return model.SerializeToString()
+
+    def _load_onnx_sessions(self):
+        """
+        Compile the three forests to ONNX Runtime sessions.
+
+        Single-row sklearn forest predicts pay milliseconds of per-call
+        overhead; the ONNX tree ensemble kernel answers in microseconds.
+        Exports are cached in ONNX_CACHE_DIR and rebuilt when the .pkl is newer.
+
+        Returns:
+            (bound session.run, input_name, float64 node values) per target,
+            or None to keep sklearn
+        """
+        if onnxruntime is None:
+            return None
+        try:
+            return self._build_onnx_sessions()
+        except Exception:
+            # Acceleration only: any conversion or runtime problem keeps sklearn
+            logger.warning("ONNX roadmap sessions unavailable; using sklearn", exc_info=True)
+            return None
+
+    def _build_onnx_sessions(self):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1  # one row per call: a pool only adds wake-ups
+        sessions = []
+        for target in self.TARGETS:
+            path = self._onnx_path(target)
+            if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.model_path):
+                with open(path, "rb") as f:
+                    onnx_bytes = f.read()
+            elif onnx is not None:
+                if not isinstance(self.model, dict) or target not in self.model:
+                    return None
+                if type(self.model[target]).__name__ != "RandomForestRegressor":
+                    return None
+                onnx_bytes = self._forest_to_onnx(self.model[target])
+                try:
+                    os.makedirs(self.ONNX_CACHE_DIR, exist_ok=True)
+                    # Atomic, so an interrupted write never leaves a torn cache
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(onnx_bytes)
+                    os.replace(path + ".tmp", path)
+                except OSError:
+                    pass  # unwritable cache: convert again next start
+            else:
+                return None
+            session = onnxruntime.InferenceSession(
+                onnx_bytes, options, providers=["CPUExecutionProvider"]
+            )
+            # The node table is a constant: fetch it once, then only leaves
+            (values,) = session.run(["values"], {"X": np.zeros((0, 14), np.float32)})
+            sessions.append((session.run, "X", values))
+        return sessions
+
     def _calculate_bmi(self, weight_kg: float, height_cm: float) -> float:
         """Calculate BMI from weight and height."""
         height_m = height_cm / 100
@@ -90,49 +315,49 @@ class RoadmapGenerator:
             user_state: Dictionary with user profile fields
 
         Returns:
-            Numpy array of encoded features (1, 14)
+            Numpy array of encoded features (1, 14). The array is this
+            thread's reusable buffer: copy it if it must outlive the next call.
         """
+        buf = getattr(self._local, "features", None)
+        if buf is None:
+            buf = self._local.features = np.zeros((1, 14), dtype=np.float32)
+        self._fill_features(buf[0], user_state)
+        return buf
+
+    def _fill_features(self, row: np.ndarray, user_state: Dict):
+        """Write the 14 encoded features of one user into a float32 row."""
+        # Fill the feature vector in exact order expected by model. float32
+        # is what the forests compare against internally, so no precision is lost
+        row[0:7] = self._numeric_features(user_state)
+        # One-hot encode activity level and fitness goal
+        row[7:11] = self._ACTIVITY_ONEHOT.get(
+            user_state.get("activity_level", "moderate"), self._NO_ACTIVITY
+        )
+        row[11:14] = self._GOAL_ONEHOT.get(
+            user_state.get("fitness_goal", "maintenance"), self._NO_GOAL
+        )
+
+    def _numeric_features(self, user_state: Dict) -> Tuple:
+        """The 7 leading (non-one-hot) features of one user."""
+        get = user_state.get
         # Base features
-        age = user_state.get("age", 30)
+        age = get("age", 30)
         weight_kg = user_state["weight_kg"]
         height_cm = user_state["height_cm"]
+        activity_level = get("activity_level", "moderate")
+        week = get("week", 1)
+        gender = get("gender", "other")
 
         # Estimate initial calorie intake (approximate based on weight and activity)
         calorie_intake = int(weight_kg * 24 * 1.2)  # BMR approximation
 
         # Estimate initial weekly exercise (based on activity level)
-        activity_level = user_state.get("activity_level", "moderate")
-        exercise_map = {
-            "sedentary": 30,
-            "light": 120,
-            "moderate": 180,
-            "active": 300,
-            "very_active": 420,
-        }
-        weekly_exercise_minutes = exercise_map.get(activity_level, 180)
-
-        week = user_state.get("week", 1)
+        weekly_exercise_minutes = self._EXERCISE_MAP.get(activity_level, 180)
 
         # One-hot encode gender (only 'male' is one-hot, others are 0)
-        gender = user_state.get("gender", "other")
         gender_male = 1 if gender == "male" else 0
 
-        # One-hot encode activity level
-        activity_sedentary = 1 if activity_level == "sedentary" else 0
-        activity_light = 1 if activity_level == "light" else 0
-        activity_moderate = 1 if activity_level == "moderate" else 0
-        activity_active = (
-            1 if activity_level == "active" or activity_level == "very_active" else 0
-        )
-
-        # One-hot encode fitness goal
-        fitness_goal = user_state.get("fitness_goal", "maintenance")
-        goal_weight_loss = 1 if fitness_goal == "weight_loss" else 0
-        goal_muscle_gain = 1 if fitness_goal == "muscle_gain" else 0
-        goal_maintenance = 1 if fitness_goal == "maintenance" else 0
-
-        # Build feature vector in exact order expected by model
-        features = [
+        return (
             age,
             weight_kg,
             height_cm,
@@ -140,16 +365,7 @@ class RoadmapGenerator:
             weekly_exercise_minutes,
             week,
             gender_male,
-            activity_sedentary,
-            activity_light,
-            activity_moderate,
-            activity_active,
-            goal_weight_loss,
-            goal_muscle_gain,
-            goal_maintenance,
-        ]
-
-        return np.array([features])
+        )
 
     def predict(self, user_state: Dict) -> Dict:
         """
@@ -157,14 +373,73 @@ class RoadmapGenerator:
         """
         # Encode features (14 features including goal encoding)
         features = self._encode_features(user_state)
+        targets = self._raw_predictions(features, [user_state])
+        (roadmap,) = self._apply_safety([user_state], *targets)
+        return roadmap
 
-        # Get raw predictions from model
-        if isinstance(self.model, dict):
-            target_weight = self.model["weight_kg"].predict(features)[0]
-            target_calories = self.model["calories"].predict(features)[0]
-            target_exercise = self.model["exercise_minutes"].predict(features)[0]
-        else:
-            prediction = self.model.predict(features)[0]
+    def predict_batch(self, user_states: List[Dict]) -> List[Dict]:
+        """
+        Generate roadmaps for many users with one model call per target.
+
+        Args:
+            user_states: User profile dicts, as accepted by predict()
+
+        Returns:
+            Roadmaps in input order, identical to calling predict() on each
+        """
+        n = len(user_states)
+        if n == 0:
+            return []
+
+        features = np.empty((n, 14), dtype=np.float32)
+        features[:, 0:7] = [self._numeric_features(u) for u in user_states]
+        # One-hot blocks as a single gather from the code tables
+        activity_codes = np.fromiter(
+            (
+                self._ACTIVITY_CODE.get(u.get("activity_level", "moderate"), -1)
+                for u in user_states
+            ),
+            dtype=np.intp,
+            count=n,
+        )
+        goal_codes = np.fromiter(
+            (
+                self._GOAL_CODE.get(u.get("fitness_goal", "maintenance"), -1)
+                for u in user_states
+            ),
+            dtype=np.intp,
+            count=n,
+        )
+        features[:, 7:11] = self._ACTIVITY_ROWS[activity_codes]
+        features[:, 11:14] = self._GOAL_ROWS[goal_codes]
+        targets = self._raw_predictions(features, user_states)
+        return self._apply_safety(user_states, *targets)
+
+    @functools.cached_property
+    def _forest_predicts(self):
+        """Bound predict of each dict-format forest, in TARGETS order."""
+        if not isinstance(self.model, dict):
+            return None
+        return tuple(self.model[target].predict for target in self.TARGETS)
+
+    def _raw_predictions(
+        self, features: np.ndarray, user_states: List[Dict]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Model (weight, calories, exercise) predictions, one array each."""
+        if self._sessions is not None:
+            predictions = []
+            for run, input_name, values in self._sessions:
+                (leaves,) = run(["leaves"], {input_name: features})
+                # cumsum adds tree by tree, like sklearn's forest average
+                leaf_values = values[leaves.astype(np.intp)]
+                predictions.append(np.cumsum(leaf_values, axis=1)[:, -1] / leaf_values.shape[1])
+            return tuple(predictions)
+
+        if self._forest_predicts is not None:
+            return tuple(predict(features) for predict in self._forest_predicts)
+
+        targets = []
+        for prediction, user_state in zip(self.model.predict(features), user_states):
             if hasattr(prediction, "__len__") and len(prediction) == 3:
                 target_weight, target_calories, target_exercise = prediction
             elif hasattr(prediction, "__len__") and len(prediction) >= 2:
@@ -177,28 +452,15 @@ class RoadmapGenerator:
                 target_weight = user_state["weight_kg"] * 0.99
                 target_calories = float(prediction)
                 target_exercise = 30
+            targets.append((target_weight, target_calories, target_exercise))
+        return tuple(np.asarray(column) for column in zip(*targets))
 
-        # 🔴 CRITICAL SAFETY FIX: Defensive validation for extreme outliers
-        # Handles NaN, negative, zero, or unrealistically low values BEFORE safety patch
-        if not np.isfinite(target_calories) or target_calories <= 0:
-            # Invalid prediction → use conservative baseline
-            original_cal = target_calories
-            target_calories = 2000
-            print(
-                f"[SAFETY] WARNING: Invalid calorie prediction (got {original_cal}). Using fallback 2000 kcal."
-            )
-        elif target_calories < 1000:
-            # Extreme outlier → enforce absolute minimum BEFORE goal-specific patch
-            original_cal = target_calories
-            target_calories = 1500
-            print(
-                f"[SAFETY] WARNING: Extreme outlier detected ({original_cal} kcal). Enforcing 1500 kcal floor."
-            )
-
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _goal_floor(goal_raw: str, gender: str) -> int:
+        """Goal-specific calorie floor (0 when the goal has none)."""
         # 🔴 CRITICAL SAFETY FIX: ROBUST GOAL DETECTION (handles spaces/underscores/variations)
-        goal_raw = user_state.get("fitness_goal", "weight_loss")
-        gender = user_state.get("gender", "female")
-        goal_lower = str(goal_raw).lower()
+        goal_lower = goal_raw.lower()
 
         # Muscle gain detection (catches 'muscle_gain', 'gain muscle', 'muscle gain', etc.)
         is_muscle_gain = (
@@ -212,23 +474,63 @@ class RoadmapGenerator:
             term in goal_lower for term in ["loss", "lose", "cut", "shed"]
         )
 
-        # Apply safety constraints (goal-specific floors)
         if is_muscle_gain:
-            min_cal = 2700 if gender == "male" else 2400
-            if target_calories < min_cal:
-                target_calories = min_cal
-        elif is_weight_loss:
-            min_cal = 1500 if gender == "male" else 1200
-            if target_calories < min_cal:
-                target_calories = min_cal
-
-        return {
-            "target_weight_kg": round(float(target_weight), 1),
-            "target_calories": int(target_calories),
-            "target_exercise_minutes": int(target_exercise),
-            "fitness_goal": goal_raw,  # Preserve original value
-            "dietary_restrictions": user_state.get("dietary_restrictions", []),
-        }
+            return 2700 if gender == "male" else 2400
+        if is_weight_loss:
+            return 1500 if gender == "male" else 1200
+        return 0
+
+    def _apply_safety(
+        self,
+        user_states: List[Dict],
+        target_weights: np.ndarray,
+        target_calories: np.ndarray,
+        target_exercises: np.ndarray,
+    ) -> List[Dict]:
+        """Apply outlier handling and goal-specific calorie floors, one roadmap per row."""
+        # 🔴 CRITICAL SAFETY FIX: Defensive validation for extreme outliers
+        # Handles NaN, negative, zero, or unrealistically low values BEFORE safety patch
+        invalid = ~np.isfinite(target_calories) | (target_calories <= 0)
+        outlier = ~invalid & (target_calories < 1000)
+        for i in np.flatnonzero(invalid):
+            # Invalid prediction → use conservative baseline
+            logger.warning(
+                "[SAFETY] Invalid calorie prediction (got %s). Using fallback 2000 kcal.",
+                target_calories[i],
+            )
+        for i in np.flatnonzero(outlier):
+            # Extreme outlier → enforce absolute minimum BEFORE goal-specific patch
+            logger.warning(
+                "[SAFETY] Extreme outlier detected (%s kcal). Enforcing 1500 kcal floor.",
+                target_calories[i],
+            )
+        calories = np.where(invalid, 2000, np.where(outlier, 1500, target_calories))
+
+        goals = [user_state.get("fitness_goal", "weight_loss") for user_state in user_states]
+
+        # Apply safety constraints (goal-specific floors)
+        floors = np.fromiter(
+            (
+                self._goal_floor(str(goal_raw), user_state.get("gender", "female"))
+                for goal_raw, user_state in zip(goals, user_states)
+            ),
+            dtype=np.float32,  # floors are exact in float32
+            count=len(user_states),
+        )
+        calories = np.maximum(calories, floors)
+
+        return [
+            {
+                "target_weight_kg": round(float(target_weight), 1),
+                "target_calories": int(target_cal),
+                "target_exercise_minutes": int(target_exercise),
+                "fitness_goal": goal_raw,  # Preserve original value
+                "dietary_restrictions": user_state.get("dietary_restrictions", []),
+            }
+            for user_state, goal_raw, target_weight, target_cal, target_exercise in zip(
+                user_states, goals, target_weights, calories, target_exercises
+            )
+        ]
 
 
 # Standalone test
@@ -240,7 +542,7 @@ if __name__ == "__main__":
     model_path = "RoadMap_model/roadmap_model.pkl"
 
     try:
-        generator = RoadmapGenerator(model_path)
+        generator = RoadmapGenerator.get(model_path)
 
         # Test user state
         test_user = {
@@ -292,9 +594,11 @@ if __name__ == "__main__":
 
         # Test week progression
         print("\n[Testing Week Progression]\n")
-        for week in [1, 2, 3, 4]:
-            test_user["week"] = week
-            roadmap = generator.predict(test_user)
+        weeks = [1, 2, 3, 4]
+        roadmaps = generator.predict_batch(
+            [{**test_user, "week": week} for week in weeks]
+        )
+        for week, roadmap in zip(weeks, roadmaps):
             print(
                 f"Week {week}: {roadmap['target_calories']} cal, {roadmap['target_weight_kg']} kg"
             )
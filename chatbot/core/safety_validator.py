@@ -3,8 +3,16 @@ Safety Validator: Mandatory Safety Gates
 Ensures all dietary recommendations meet medical and nutritional safety standards.
 """
 
+import functools
+import logging
+import re
 from typing import Dict, List, Tuple
 
+# Gate results go through logging so disabled levels cost no formatting.
+# With no logging configured, warnings and errors still reach stderr via
+# logging's last-resort handler; verbose=True also echoes the info lines.
+logger = logging.getLogger(__name__)
+
 class SafetyValidator:
     """
     Implements 4 validation gates that every meal plan must pass.
@@ -24,6 +32,30 @@ class SafetyValidator:
         'cheese', 'cream', 'olives'
     ]
     CONDIMENTS = ['sauce', 'spices', 'salt', 'pepper', 'sugar', 'honey']
+    # Name fragments of foods checked against the condiment/oil portion range,
+    # matched in one pass over the name
+    _SMALL_OK_TERMS = tuple(CONDIMENTS + OILS_AND_FATS)
+    _SMALL_OK_RE = re.compile("|".join(map(re.escape, _SMALL_OK_TERMS)))
+
+    def __init__(self, verbose: bool = False):
+        """
+        Args:
+            verbose: Echo gate results to stderr
+        """
+        self.verbose = verbose
+        if verbose and not any(
+            isinstance(h, logging.StreamHandler) for h in logger.handlers
+        ):
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("[SAFETY] %(levelname)s: %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _is_small_ok_name(name: str) -> bool:
+        """Whether a food name is a condiment/oil; plans reuse a few dozen names."""
+        return SafetyValidator._SMALL_OK_RE.search(name.lower()) is not None
 
     def validate_meal_plan(self, meal_plan: dict, daily_target_calories: int, restrictions: list) -> tuple:
         """
@@ -31,44 +63,47 @@ class SafetyValidator:
         Returns: (is_valid: bool, errors: list)
         """
         errors = []
+        if isinstance(restrictions, str):
+            restrictions = [r.strip() for r in restrictions.split(",") if r.strip()]
+        restrict_set = frozenset(restrictions or ())
         
         # Gate 1: Allergen filtering (zero tolerance)
         for meal_name, meal in meal_plan.items():
             if meal_name == 'daily_summary' or "foods" not in meal:
                 continue
             for food in meal["foods"]:
-                if any(r in food.get("allergens", []) for r in restrictions):
+                if not restrict_set.isdisjoint(food.get("allergens", ())):
                     error = f"[SAFETY] ALLERGEN VIOLATION: {food['name']} in {meal_name}"
-                    print(error)
+                    logger.error("ALLERGEN VIOLATION: %s in %s", food['name'], meal_name)
                     errors.append(error)
                     return False, errors  # Fail fast on allergens
         
         # Gate 2: FIXED portion checks (30g-600g range)
+        is_small_ok = self._is_small_ok_name
         for meal_name, meal in meal_plan.items():
             if meal_name == 'daily_summary' or "foods" not in meal:
                 continue
             for food in meal["foods"]:
                 portion = food.get("portion_g", 0)
-                name = food.get("name", "Unknown").lower()
                 
                 # Check if it's a condiment/oil that can be smaller
-                is_tiny_ok = any(x in name for x in self.CONDIMENTS + self.OILS_AND_FATS)
+                is_tiny_ok = is_small_ok(food.get("name", "Unknown"))
                 
                 if is_tiny_ok:
                     # Condiments/oils: 5-50g is reasonable
                     if portion < 5 or portion > 50:
                         error = f"Condiment portion unusual: {food['name']} ({portion}g)"
-                        print(f"[SAFETY] WARNING: {error}")
+                        logger.warning("%s", error)
                         errors.append(error)
                 else:
                     # Regular foods: 30-600g
                     if portion < 15:
                         error = f"Portion too small: {food['name']} ({portion}g < 15g)"
-                        print(f"[SAFETY] ERROR: {error}")
+                        logger.error("%s", error)
                         errors.append(error)
                     elif portion > 600:
                         error = f"Portion too large: {food['name']} ({portion}g > 600g)"
-                        print(f"[SAFETY] ERROR: {error}")
+                        logger.error("%s", error)
                         errors.append(error)
         
         # Gate 3: Minimum protein per main meal (15g threshold)
@@ -78,15 +113,15 @@ class SafetyValidator:
                 protein = meal.get("total_protein_g", 0)
                 if protein < 15:
                     error = f"Low protein: {meal_name} has {protein:.1f}g (<15g)"
-                    print(f"[SAFETY] WARNING: {error}")
+                    logger.warning("%s", error)
                     errors.append(error)
         
         # Return result
         if len(errors) == 0:
-            print("[SAFETY] All checks passed")
+            logger.info("All checks passed")
             return True, []
         else:
-            print(f"[SAFETY] {len(errors)} validation issues found")
+            logger.info("%d validation issues found", len(errors))
             return len(errors) == 0, errors
 
 
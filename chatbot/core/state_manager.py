@@ -3,17 +3,38 @@ State Manager: Persistent User Profile Management
 Handles user state tracking, week progression, and cold-start scenarios.
 """
 
+import copy
 import json
 import os
 from datetime import datetime
 from typing import Dict, Optional
 from threading import Lock
+from urllib.parse import quote, unquote
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps persistence working without orjson
+    orjson = None
+
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to indented UTF-8 JSON bytes (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 class StateManager:
     """
     Manages persistent user state with week tracking for Model 2.
     Thread-safe JSON-based storage with cold-start handling.
+    Each user's profile lives in its own file, so a write costs one profile.
     """
     
     # Default profile for new users (cold-start)
@@ -33,38 +54,97 @@ class StateManager:
         Initialize State Manager.
         
         Args:
-            storage_path: Path to JSON file for persistent storage
+            storage_path: Path to JSON storage; profiles are kept one file
+                per user in the directory of the same name without ".json"
         """
         self.storage_path = storage_path
+        self.shard_dir = os.path.splitext(storage_path)[0]
         self.lock = Lock()  # Thread-safe file access
         
-        # Ensure parent directory exists
-        os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
+        # Ensure storage directory exists
+        os.makedirs(self.shard_dir, exist_ok=True)
+        
+        # Parsed once; reads are served from memory, writes go through.
+        # Profiles go in and out as deep copies so callers never alias them
+        self._cache = self._read_storage_from_disk()
         
-        # Initialize storage file if it doesn't exist
-        if not os.path.exists(self.storage_path):
-            self._write_storage({})
+        # Split a store written by the single-file layout into shards
+        if (os.path.exists(self.storage_path)
+                and not os.path.exists(self._migrated_marker)):
+            self._migrate_single_file_store()
     
-    def _read_storage(self) -> Dict:
-        """Thread-safe read from JSON storage."""
-        with self.lock:
+    @property
+    def _migrated_marker(self) -> str:
+        return os.path.join(self.shard_dir, '.legacy_migrated')
+    
+    def _shard_path(self, user_id: str) -> str:
+        return os.path.join(self.shard_dir, quote(user_id, safe='') + '.json')
+    
+    def _read_storage_from_disk(self) -> Dict:
+        """Parse every profile shard."""
+        storage = {}
+        for name in os.listdir(self.shard_dir):
+            if not name.endswith('.json'):
+                continue  # leftover .tmp from an interrupted write
             try:
-                with open(self.storage_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(os.path.join(self.shard_dir, name), 'rb') as f:
+                    storage[unquote(name[:-len('.json')])] = _json_loads(f.read())
             except (json.JSONDecodeError, FileNotFoundError):
-                # Corrupted or missing file - reinitialize
-                return {}
+                # Corrupted or vanished shard - treat the user as new
+                continue
+        return storage
     
-    def _write_storage(self, data: Dict) -> None:
-        """Thread-safe atomic write to JSON storage."""
-        with self.lock:
-            # Atomic write: write to temp file, then rename
-            temp_path = self.storage_path + '.tmp'
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            
-            # Atomic rename (overwrites existing file)
-            os.replace(temp_path, self.storage_path)
+    def _migrate_single_file_store(self) -> None:
+        """
+        Copy profiles out of the legacy single-file store, once.
+        
+        The file ({user_id: profile}) may be the same data/user_profiles.json
+        ConversationManager migrates ({user_id: conversation}, told apart by
+        "current_state"), so it is left in place and only this store's
+        records are taken; a marker in the shard dir records completion.
+        """
+        try:
+            with open(self.storage_path, 'rb') as f:
+                legacy = _json_loads(f.read())
+        except json.JSONDecodeError:
+            legacy = {}
+        
+        for user_id, profile in legacy.items():
+            if not isinstance(profile, dict) or 'current_state' in profile:
+                continue  # not a StateManager profile
+            if user_id not in self._cache:
+                self._cache[user_id] = profile
+                self._write_storage(user_id)
+        with open(self._migrated_marker, 'wb'):
+            pass
+    
+    def _read_storage(self) -> Dict:
+        """In-memory storage; callers hold self.lock."""
+        return self._cache
+    
+    def _new_profile(self, user_id: str, now: str) -> Dict:
+        """Fresh cold-start profile (its list fields are not shared)."""
+        profile = copy.deepcopy(self.DEFAULT_PROFILE)
+        profile['user_id'] = user_id
+        profile['created_at'] = now
+        return profile
+    
+    def _write_storage(self, user_id: str) -> None:
+        """Atomic write of one user's shard. Callers hold self.lock."""
+        path = self._shard_path(user_id)
+        if user_id not in self._cache:
+            # Deleted user: drop the shard
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        
+        # Atomic write: write to temp file, then rename
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(_json_dumps(self._cache[user_id]))
+        
+        # Atomic rename (overwrites existing file)
+        os.replace(temp_path, path)
     
     def get_user_state(self, user_id: str, intent: Optional[str] = None) -> Dict:
         """
@@ -77,33 +157,32 @@ class StateManager:
         Returns:
             User state dictionary with all required fields
         """
-        storage = self._read_storage()
-        
-        if user_id in storage:
-            # Existing user
-            return storage[user_id].copy()
-        else:
-            # New user - cold-start handling
-            profile = self.DEFAULT_PROFILE.copy()
-            profile['user_id'] = user_id
-            profile['created_at'] = datetime.now().isoformat()
-            profile['last_updated'] = datetime.now().isoformat()
+        with self.lock:
+            storage = self._read_storage()
             
-            # Extract fitness goal from intent if available
-            if intent:
-                if 'weight_loss' in intent.lower():
-                    profile['fitness_goal'] = 'weight_loss'
-                elif 'muscle_gain' in intent.lower() or 'muscle' in intent.lower():
-                    profile['fitness_goal'] = 'muscle_gain'
-                elif 'maintenance' in intent.lower():
-                    profile['fitness_goal'] = 'maintenance'
+            if user_id in storage:
+                # Existing user
+                return copy.deepcopy(storage[user_id])
+            else:
+                # New user - cold-start handling
+                profile = self._new_profile(user_id, datetime.now().isoformat())
+                profile['last_updated'] = profile['created_at']
             
-            # Save new profile
-            storage[user_id] = profile
-            self._write_storage(storage)
+                # Extract fitness goal from intent if available
+                if intent:
+                    if 'weight_loss' in intent.lower():
+                        profile['fitness_goal'] = 'weight_loss'
+                    elif 'muscle_gain' in intent.lower() or 'muscle' in intent.lower():
+                        profile['fitness_goal'] = 'muscle_gain'
+                    elif 'maintenance' in intent.lower():
+                        profile['fitness_goal'] = 'maintenance'
+            
+                # Save new profile
+                storage[user_id] = profile
+                self._write_storage(user_id)
+            
+                return copy.deepcopy(profile)
             
-            return profile.copy()
-    
     def update_user_profile(self, user_id: str, updates: Dict) -> Dict:
         """
         Update user profile with new information.
@@ -115,21 +194,22 @@ class StateManager:
         Returns:
             Updated user profile
         """
-        storage = self._read_storage()
-        
-        if user_id not in storage:
-            # Create new profile if doesn't exist
-            storage[user_id] = self.DEFAULT_PROFILE.copy()
-            storage[user_id]['user_id'] = user_id
-            storage[user_id]['created_at'] = datetime.now().isoformat()
-        
-        # Update fields
-        storage[user_id].update(updates)
-        storage[user_id]['last_updated'] = datetime.now().isoformat()
-        
-        self._write_storage(storage)
-        return storage[user_id].copy()
-    
+        with self.lock:
+            storage = self._read_storage()
+            # One clock read per update; created_at and last_updated agree
+            now = datetime.now().isoformat()
+            
+            if user_id not in storage:
+                # Create new profile if doesn't exist
+                storage[user_id] = self._new_profile(user_id, now)
+            
+            # Update fields
+            storage[user_id].update(copy.deepcopy(updates))
+            storage[user_id]['last_updated'] = now
+            
+            self._write_storage(user_id)
+            return copy.deepcopy(storage[user_id])
+            
     def update_user_progress(self, user_id: str, roadmap: Dict) -> Dict:
         """
         Update user progress after generating roadmap.
@@ -142,27 +222,28 @@ class StateManager:
         Returns:
             Updated user profile
         """
-        storage = self._read_storage()
-        
-        if user_id not in storage:
-            # Should not happen, but handle gracefully
-            storage[user_id] = self.DEFAULT_PROFILE.copy()
-            storage[user_id]['user_id'] = user_id
-            storage[user_id]['created_at'] = datetime.now().isoformat()
-        
-        # Increment week counter (critical for Model 2)
-        current_week = storage[user_id].get('week', 1)
-        storage[user_id]['week'] = current_week + 1
-        
-        # Update weight if provided in roadmap
-        if 'target_weight_kg' in roadmap:
-            storage[user_id]['weight_kg'] = roadmap['target_weight_kg']
-        
-        storage[user_id]['last_updated'] = datetime.now().isoformat()
-        
-        self._write_storage(storage)
-        return storage[user_id].copy()
-    
+        with self.lock:
+            storage = self._read_storage()
+            # One clock read per update; created_at and last_updated agree
+            now = datetime.now().isoformat()
+            
+            if user_id not in storage:
+                # Should not happen, but handle gracefully
+                storage[user_id] = self._new_profile(user_id, now)
+            
+            # Increment week counter (critical for Model 2)
+            current_week = storage[user_id].get('week', 1)
+            storage[user_id]['week'] = current_week + 1
+            
+            # Update weight if provided in roadmap
+            if 'target_weight_kg' in roadmap:
+                storage[user_id]['weight_kg'] = roadmap['target_weight_kg']
+            
+            storage[user_id]['last_updated'] = now
+            
+            self._write_storage(user_id)
+            return copy.deepcopy(storage[user_id])
+            
     def set_user_restrictions(self, user_id: str, restrictions: list) -> Dict:
         """
         Set dietary restrictions for user.
@@ -195,8 +276,10 @@ class StateManager:
         Returns:
             Dictionary of all user profiles
         """
-        return self._read_storage()
-    
+        with self.lock:
+            storage = self._read_storage()
+            return copy.deepcopy(storage)
+            
     def delete_user(self, user_id: str) -> bool:
         """
         Delete a user profile.
@@ -207,18 +290,21 @@ class StateManager:
         Returns:
             True if deleted, False if user didn't exist
         """
-        storage = self._read_storage()
-        
-        if user_id in storage:
-            del storage[user_id]
-            self._write_storage(storage)
-            return True
-        
-        return False
+        with self.lock:
+            storage = self._read_storage()
+            
+            if user_id in storage:
+                del storage[user_id]
+                self._write_storage(user_id)
+                return True
+            
+            return False
 
 
 # Standalone test
 if __name__ == "__main__":
+    import shutil
+    
     print("=" * 60)
     print("State Manager - Test Suite")
     print("=" * 60)
@@ -259,8 +345,7 @@ if __name__ == "__main__":
     print(f"✓ Total users: {len(all_users)}")
     
     # Cleanup
-    if os.path.exists(test_storage):
-        os.remove(test_storage)
+    shutil.rmtree(manager.shard_dir, ignore_errors=True)
     
     print("\n" + "=" * 60)
     print("All tests passed! ✓")
@@ -0,0 +1,31 @@
+"""
+Gunicorn config for the chatbot API (Linux/Mac production).
+Run from chatbot/: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = "0.0.0.0:5000"
+worker_class = "gthread"
+threads = 4
+
+# Conversation state lives in each worker's ConversationManager, so keep a
+# single process unless the profile store is shared between workers.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# Import the app once in the master; forked workers share its pages copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    """Runs in the master after the preloaded app is imported, before forking."""
+    import gc
+
+    from core.conversation_manager import preload_models
+
+    # Plan models are otherwise loaded lazily by each worker on its first
+    # plan request; loading them here lets every worker share one copy
+    preload_models()
+    # Keep the shared objects out of the collector so GC passes in the
+    # workers don't write to (and un-share) their pages
+    gc.freeze()
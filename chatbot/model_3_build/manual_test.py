@@ -59,6 +59,8 @@ def main():
     # Initialize recommender
     print("\nInitializing Food Recommender...")
     recommender = FoodRecommender('model3_food_database.json')
+    # Build the food pools for every sample's restrictions up front
+    recommender.warmup([(), ("vegetarian",), ("no_dairy", "no_nuts"), ("vegan",)])
     print("[OK] Successfully loaded 53 foods from database\n")
     
     # ========================================================================
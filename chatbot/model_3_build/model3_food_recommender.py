@@ -5,9 +5,36 @@ Author: AI-Assisted Implementation
 Date: 2026-01-27
 """
 
+import functools
 import json
 import math
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback for the database and plan cache
+    orjson = None
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _restriction_key(restrictions) -> frozenset:
+    """Restrictions as a cache key; a bare string is a CSV list, not its characters."""
+    if isinstance(restrictions, str):
+        return frozenset(r.strip() for r in restrictions.split(",") if r.strip())
+    return frozenset(restrictions or ())
 
 
 class FoodRecommender:
@@ -43,6 +70,19 @@ class FoodRecommender:
     CALORIE_TOLERANCE = 0.03  # ±3%
     MACRO_TOLERANCE = 0.05  # ±5%
     VEGETABLE_PORTION = 90  # grams (fixed for volume/fiber)
+    PROTEIN_CHECKED_MEALS = frozenset(("breakfast", "lunch", "dinner"))  # Not snack
+
+    # Preferred foods per meal slot (ids)
+    COMPLEX_CARBS = frozenset(
+        ("quinoa", "oats", "brown_rice", "whole_wheat_pasta", "sweet_potato")
+    )
+    VEG_PRIORITY = frozenset(("broccoli", "spinach", "kale", "bell_pepper"))
+    FAT_PRIORITY = frozenset(("olive_oil", "avocado", "chia_seeds", "flaxseeds"))
+
+    # Distinct restriction sets whose per-slot best foods are kept
+    POOL_CACHE_SIZE = 256
+    # Distinct (calories, goal, restrictions) plans kept serialized
+    PLAN_CACHE_SIZE = 256
 
     def __init__(self, foods_json_path: str):
         """
@@ -51,13 +91,78 @@ class FoodRecommender:
         Args:
             foods_json_path: Path to the JSON file containing food database
         """
-        with open(foods_json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(foods_json_path, "rb") as f:
+            data = _json_loads(f.read())
             self.foods = data["foods"]
 
+        self._annotate_foods()
+
         # Organize foods by category for efficient lookup
         self.foods_by_category = self._organize_by_category()
 
+        # Column-wise copies of the database, one row per food. Restriction
+        # filtering becomes boolean mask arithmetic and portion math reads
+        # one macro row instead of four dict lookups
+        self.food_row = {food["id"]: i for i, food in enumerate(self.foods)}
+        self.macros = np.array(
+            [
+                (food["calories_per_100g"], food["protein_g"], food["carbs_g"], food["fat_g"])
+                for food in self.foods
+            ],
+            dtype=np.float64,
+        )
+        self.is_vegetarian = np.array([bool(food["vegetarian"]) for food in self.foods])
+        self.is_vegan = np.array([bool(food["vegan"]) for food in self.foods])
+        # One bit per allergen; each food's allergens OR'd into a uint64
+        self.allergen_bit = {
+            allergen: 1 << i
+            for i, allergen in enumerate(
+                sorted({a for food in self.foods for a in food["allergens"]})
+            )
+        }
+        self.food_allergen_mask = np.zeros(len(self.foods), dtype=np.uint64)
+        for i, food in enumerate(self.foods):
+            for allergen in food["allergens"]:
+                self.food_allergen_mask[i] |= np.uint64(self.allergen_bit[allergen])
+        # 'no_nuts' covers both kinds of nut
+        self.allergen_bit["nuts"] = self.allergen_bit.get(
+            "tree nuts", 0
+        ) | self.allergen_bit.get("peanuts", 0)
+        # Restriction string -> forbidden allergen bits, so matching a
+        # restriction is one dict lookup instead of prefix parsing
+        self.restriction_bits = {
+            "no_" + allergen: bit for allergen, bit in self.allergen_bit.items()
+        }
+
+        # Grams of (protein, carbs, fat) per target calorie for each goal
+        self._goal_grams_per_cal = {
+            goal: (
+                ratios["protein"] / self.PROTEIN_CAL_PER_G,
+                ratios["carbs"] / self.CARB_CAL_PER_G,
+                ratios["fat"] / self.FAT_CAL_PER_G,
+            )
+            for goal, ratios in self.MACRO_RATIOS.items()
+        }
+
+        # Every meal of a plan (and every plan for the same restrictions)
+        # picks from the same filtered pools; keyed by frozenset(restrictions)
+        self._best_foods = functools.lru_cache(maxsize=self.POOL_CACHE_SIZE)(
+            self._build_best_foods
+        )
+        # Plans are deterministic in their inputs. Cached as JSON bytes so
+        # every caller gets a fresh copy it is free to mutate; typed keeps
+        # 1842 and 1842.0 apart since they format differently
+        self._plan_json = functools.lru_cache(maxsize=self.PLAN_CACHE_SIZE, typed=True)(
+            lambda *args: _json_dumps(self._build_plan(*args))
+        )
+
+    def _annotate_foods(self):
+        """Tag each food with its meal-slot preference flags, read by the pick keys."""
+        for food in self.foods:
+            food["_is_complex_carb"] = food["id"] in self.COMPLEX_CARBS
+            food["_is_veg_priority"] = food["id"] in self.VEG_PRIORITY
+            food["_is_fat_priority"] = food["id"] in self.FAT_PRIORITY
+
     def _organize_by_category(self) -> Dict[str, List[Dict]]:
         """Organize foods by category for efficient filtering."""
         categories = {}
@@ -84,11 +189,10 @@ class FoodRecommender:
                 f"Invalid goal: {goal}. Must be one of {list(self.MACRO_RATIOS.keys())}"
             )
 
-        ratios = self.MACRO_RATIOS[goal]
-
-        protein_g = (calories * ratios["protein"]) / self.PROTEIN_CAL_PER_G
-        carbs_g = (calories * ratios["carbs"]) / self.CARB_CAL_PER_G
-        fat_g = (calories * ratios["fat"]) / self.FAT_CAL_PER_G
+        protein_per_cal, carbs_per_cal, fat_per_cal = self._goal_grams_per_cal[goal]
+        protein_g = calories * protein_per_cal
+        carbs_g = calories * carbs_per_cal
+        fat_g = calories * fat_per_cal
 
         return {
             "protein_g": round(protein_g, 1),
@@ -112,49 +216,105 @@ class FoodRecommender:
         if not restrictions or restrictions == ["none"]:
             return foods
 
-        filtered = []
-        for food in foods:
-            # Check vegetarian/vegan requirements
-            if "vegetarian" in restrictions and not food["vegetarian"]:
-                continue
-            if "vegan" in restrictions and not food["vegan"]:
-                continue
-
-            # Check allergen exclusions (restrictions like 'no_dairy', 'no_nuts')
-            allergen_match = False
-            for restriction in restrictions:
-                if restriction.startswith("no_"):
-                    allergen = restriction[3:]  # Remove 'no_' prefix
-                    # Handle special cases
-                    if allergen == "nuts":
-                        if (
-                            "tree nuts" in food["allergens"]
-                            or "peanuts" in food["allergens"]
-                        ):
-                            allergen_match = True
-                            break
-                    else:
-                        if allergen in food["allergens"]:
-                            allergen_match = True
-                            break
-
-            if not allergen_match:
-                filtered.append(food)
-
-        return filtered
-
-    def _calculate_portion_calories(
-        self, food: Dict, portion_g: float
-    ) -> Dict[str, float]:
-        """Calculate nutritional values for a specific portion."""
-        factor = portion_g / 100
+        allowed = self._allowed_mask(restrictions)
+        food_row = self.food_row
+        return [food for food in foods if allowed[food_row[food["id"]]]]
+
+    def _allowed_mask(self, restrictions) -> np.ndarray:
+        """Boolean mask over self.foods of the foods the restrictions permit."""
+        allowed = np.ones(len(self.foods), dtype=bool)
+
+        # Check vegetarian/vegan requirements
+        if "vegetarian" in restrictions:
+            allowed &= self.is_vegetarian
+        if "vegan" in restrictions:
+            allowed &= self.is_vegan
+
+        # Check allergen exclusions (restrictions like 'no_dairy', 'no_nuts')
+        forbidden = self._restrictions_to_mask(restrictions)
+        if forbidden:
+            allowed &= (self.food_allergen_mask & np.uint64(forbidden)) == 0
+
+        return allowed
+
+    def _restrictions_to_mask(self, restrictions) -> int:
+        """Allergen bits excluded by 'no_<allergen>' restrictions."""
+        restriction_bits = self.restriction_bits
+        forbidden = 0
+        for restriction in restrictions:
+            # Unknown restrictions and allergens exclude nothing
+            forbidden |= restriction_bits.get(restriction, 0)
+        return forbidden
+
+    def _build_best_foods(self, restrictions: frozenset) -> Dict[str, Optional[Dict]]:
+        """
+        Pick each meal slot's preferred food among those the restrictions allow.
+
+        Only the top candidate is ever used, so this is one max() pass per
+        slot; max() keeps the first of equal keys, like the old stable sort.
+
+        Returns:
+            Dict of slot -> best food, or None when nothing qualifies
+        """
+        by_category = self.foods_by_category
+        # One mask serves all four slots
+        allowed = self._allowed_mask(restrictions)
+        food_row = self.food_row
+
+        def best(foods, key):
+            return max(
+                (food for food in foods if allowed[food_row[food["id"]]]),
+                key=key,
+                default=None,
+            )
+
         return {
-            "calories": round(food["calories_per_100g"] * factor, 1),
-            "protein_g": round(food["protein_g"] * factor, 1),
-            "carbs_g": round(food["carbs_g"] * factor, 1),
-            "fat_g": round(food["fat_g"] * factor, 1),
+            # Highest protein density (protein per 100g)
+            "protein": best(by_category.get("protein", []), lambda x: x["protein_g"]),
+            # Prefer quinoa, oats, brown rice (complex carbs)
+            "grain": best(
+                by_category.get("grain", []) + by_category.get("carb", []),
+                lambda x: (x["_is_complex_carb"], x["fiber_g"]),
+            ),
+            # Select nutrient-dense vegetables (high fiber, micronutrients)
+            "vegetable": best(
+                by_category.get("vegetable", []),
+                lambda x: (x["_is_veg_priority"], x["fiber_g"]),
+            ),
+            # Prefer oils and seeds over nuts (for allergen safety and calorie density)
+            "fat": best(by_category.get("fat", []), lambda x: x["_is_fat_priority"]),
         }
 
+    def _add_food(
+        self, selected_foods: List[Dict], total_nutrition: Dict, food: Dict, portion_g: float
+    ):
+        """Append one food at portion_g to a meal and add it to the meal totals."""
+        # Nutrition for this portion, from the food's per-100g macro row
+        factor = portion_g / 100
+        calories, protein_g, carbs_g, fat_g = (
+            self.macros[self.food_row[food["id"]]] * factor
+        ).tolist()
+        calories = round(calories, 1)
+        protein_g = round(protein_g, 1)
+        carbs_g = round(carbs_g, 1)
+        fat_g = round(fat_g, 1)
+        # The output entry is the only dict built per food
+        selected_foods.append(
+            {
+                "id": food["id"],
+                "name": food["name"],
+                "portion_g": round(portion_g, 0),
+                "calories": calories,
+                "protein_g": protein_g,
+                "carbs_g": carbs_g,
+                "fat_g": fat_g,
+            }
+        )
+        total_nutrition["calories"] += calories
+        total_nutrition["protein_g"] += protein_g
+        total_nutrition["carbs_g"] += carbs_g
+        total_nutrition["fat_g"] += fat_g
+
     def build_meal(
         self,
         meal_calories: int,
@@ -178,17 +338,12 @@ class FoodRecommender:
         """
         selected_foods = []
         total_nutrition = {"calories": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0}
+        best_foods = self._best_foods(_restriction_key(restrictions))
 
         # Step 1: Select protein source (highest protein density)
-        protein_foods = self._filter_by_restrictions(
-            self.foods_by_category.get("protein", []), restrictions
-        )
-
-        if protein_foods:
-            # Sort by protein density (protein per 100g)
-            protein_foods.sort(key=lambda x: x["protein_g"], reverse=True)
-            best_protein = protein_foods[0]
+        best_protein = best_foods["protein"]
 
+        if best_protein is not None:
             # Calculate portion needed (aim for 60% of protein target)
             protein_needed = meal_protein_g * 0.6
             portion_g = min(
@@ -198,40 +353,12 @@ class FoodRecommender:
                 self.MAX_PORTION,
             )
 
-            nutrition = self._calculate_portion_calories(best_protein, portion_g)
-            selected_foods.append(
-                {
-                    "id": best_protein["id"],
-                    "name": best_protein["name"],
-                    "portion_g": round(portion_g, 0),
-                    **nutrition,
-                }
-            )
-
-            for key in total_nutrition:
-                total_nutrition[key] += nutrition[key]
+            self._add_food(selected_foods, total_nutrition, best_protein, portion_g)
 
         # Step 2: Select grain/carb source (prefer complex carbs)
-        grain_foods = self._filter_by_restrictions(
-            self.foods_by_category.get("grain", [])
-            + self.foods_by_category.get("carb", []),
-            restrictions,
-        )
-
-        if grain_foods:
-            # Prefer quinoa, oats, brown rice (complex carbs)
-            complex_carbs = [
-                "quinoa",
-                "oats",
-                "brown_rice",
-                "whole_wheat_pasta",
-                "sweet_potato",
-            ]
-            grain_foods.sort(
-                key=lambda x: (x["id"] in complex_carbs, x["fiber_g"]), reverse=True
-            )
-            best_grain = grain_foods[0]
+        best_grain = best_foods["grain"]
 
+        if best_grain is not None:
             # Calculate portion for remaining carbs
             carbs_needed = max(meal_carbs_g - total_nutrition["carbs_g"], 0)
             portion_g = min(
@@ -239,100 +366,60 @@ class FoodRecommender:
                 self.MAX_PORTION,
             )
 
-            nutrition = self._calculate_portion_calories(best_grain, portion_g)
-            selected_foods.append(
-                {
-                    "id": best_grain["id"],
-                    "name": best_grain["name"],
-                    "portion_g": round(portion_g, 0),
-                    **nutrition,
-                }
-            )
-
-            for key in total_nutrition:
-                total_nutrition[key] += nutrition[key]
+            self._add_food(selected_foods, total_nutrition, best_grain, portion_g)
 
         # Step 3: Add vegetable (fixed portion for fiber/volume)
-        vegetable_foods = self._filter_by_restrictions(
-            self.foods_by_category.get("vegetable", []), restrictions
-        )
-
-        if vegetable_foods:
-            # Select nutrient-dense vegetables (high fiber, micronutrients)
-            veg_priority = ["broccoli", "spinach", "kale", "bell_pepper"]
-            vegetable_foods.sort(
-                key=lambda x: (x["id"] in veg_priority, x["fiber_g"]), reverse=True
-            )
-            best_veg = vegetable_foods[0]
+        best_veg = best_foods["vegetable"]
 
+        if best_veg is not None:
             portion_g = self.VEGETABLE_PORTION
-            nutrition = self._calculate_portion_calories(best_veg, portion_g)
-            selected_foods.append(
-                {
-                    "id": best_veg["id"],
-                    "name": best_veg["name"],
-                    "portion_g": round(portion_g, 0),
-                    **nutrition,
-                }
-            )
-
-            for key in total_nutrition:
-                total_nutrition[key] += nutrition[key]
+            self._add_food(selected_foods, total_nutrition, best_veg, portion_g)
 
         # Step 4: Add healthy fat if needed
         if total_nutrition["fat_g"] < meal_fat_g * 0.7:
-            fat_foods = self._filter_by_restrictions(
-                self.foods_by_category.get("fat", []), restrictions
-            )
-
-            if fat_foods:
-                # Prefer oils and seeds over nuts (for allergen safety and calorie density)
-                fat_priority = ["olive_oil", "avocado", "chia_seeds", "flaxseeds"]
-                fat_foods.sort(key=lambda x: x["id"] in fat_priority, reverse=True)
-                best_fat = fat_foods[0]
+            best_fat = best_foods["fat"]
 
+            if best_fat is not None:
                 fat_needed = max(meal_fat_g - total_nutrition["fat_g"], 0)
                 portion_g = min(
                     max((fat_needed / best_fat["fat_g"]) * 100, 5), 30
                 )  # Small portions for fats
 
-                nutrition = self._calculate_portion_calories(best_fat, portion_g)
-                selected_foods.append(
-                    {
-                        "id": best_fat["id"],
-                        "name": best_fat["name"],
-                        "portion_g": round(portion_g, 0),
-                        **nutrition,
-                    }
-                )
-
-                for key in total_nutrition:
-                    total_nutrition[key] += nutrition[key]
+                self._add_food(selected_foods, total_nutrition, best_fat, portion_g)
 
         # Step 5: Scale all portions to hit exact calorie target
-        if total_nutrition["calories"] > 0:
-            scale_factor = meal_calories / total_nutrition["calories"]
-            # Only scale if deviation is significant (>3%) and scale factor is reasonable
-            if abs(1 - scale_factor) > 0.03 and 0.7 <= scale_factor <= 1.3:
+        current_calories = total_nutrition["calories"]
+        # Only scale if deviation is significant (>3%); meals already within
+        # tolerance skip the division entirely
+        if current_calories > 0 and abs(
+            current_calories - meal_calories
+        ) > self.CALORIE_TOLERANCE * current_calories:
+            scale_factor = meal_calories / current_calories
+            # ...and the scale factor is reasonable
+            if 0.7 <= scale_factor <= 1.3:
+                # Scale each food and recalculate totals in the same pass
+                total_calories = total_protein = total_carbs = total_fat = 0
                 for food in selected_foods:
+                    calories = round(food["calories"] * scale_factor, 1)
+                    protein_g = round(food["protein_g"] * scale_factor, 1)
+                    carbs_g = round(food["carbs_g"] * scale_factor, 1)
+                    fat_g = round(food["fat_g"] * scale_factor, 1)
                     food["portion_g"] = round(food["portion_g"] * scale_factor, 0)
-                    food["calories"] = round(food["calories"] * scale_factor, 1)
-                    food["protein_g"] = round(food["protein_g"] * scale_factor, 1)
-                    food["carbs_g"] = round(food["carbs_g"] * scale_factor, 1)
-                    food["fat_g"] = round(food["fat_g"] * scale_factor, 1)
+                    food["calories"] = calories
+                    food["protein_g"] = protein_g
+                    food["carbs_g"] = carbs_g
+                    food["fat_g"] = fat_g
+                    total_calories += calories
+                    total_protein += protein_g
+                    total_carbs += carbs_g
+                    total_fat += fat_g
 
-                # Recalculate totals
                 total_nutrition = {
-                    "calories": 0,
-                    "protein_g": 0,
-                    "carbs_g": 0,
-                    "fat_g": 0,
+                    "calories": total_calories,
+                    "protein_g": total_protein,
+                    "carbs_g": total_carbs,
+                    "fat_g": total_fat,
                 }
-                for food in selected_foods:
-                    total_nutrition["calories"] += food["calories"]
-                    total_nutrition["protein_g"] += food["protein_g"]
-                    total_nutrition["carbs_g"] += food["carbs_g"]
-                    total_nutrition["fat_g"] += food["fat_g"]
 
         # Round totals
         for key in total_nutrition:
@@ -376,35 +463,47 @@ class FoodRecommender:
             Tuple of (is_valid, list_of_errors)
         """
         errors = []
+        portion_errors = []
+        min_portion, max_portion = self.MIN_PORTION, self.MAX_PORTION
 
-        # Check minimum protein per meal
         for meal_name, meal_data in meal_plan.items():
-            if meal_name in ["breakfast", "lunch", "dinner"]:  # Not snack
+            # Check minimum protein per meal
+            if meal_name in self.PROTEIN_CHECKED_MEALS:
                 if meal_data["total_protein_g"] < self.MIN_PROTEIN_PER_MEAL:
                     errors.append(
                         f"{meal_name} has insufficient protein: {meal_data['total_protein_g']}g < {self.MIN_PROTEIN_PER_MEAL}g"
                     )
 
-        # Check portion sizes
-        for meal_name, meal_data in meal_plan.items():
+            # Check portion sizes
             for food in meal_data["foods"]:
-                if (
-                    food["portion_g"] < self.MIN_PORTION
-                    or food["portion_g"] > self.MAX_PORTION
-                ):
-                    if food["portion_g"] > 50:  # Ignore tiny portions like oil
-                        errors.append(
-                            f"Unsafe portion in {meal_name}: {food['name']} = {food['portion_g']}g"
-                        )
+                portion_g = food["portion_g"]
+                # Ignore tiny portions like oil
+                if portion_g > 50 and not min_portion <= portion_g <= max_portion:
+                    portion_errors.append(
+                        f"Unsafe portion in {meal_name}: {food['name']} = {portion_g}g"
+                    )
 
+        # Protein errors are reported ahead of portion errors
+        errors.extend(portion_errors)
         return len(errors) == 0, errors
 
+    def warmup(self, restriction_sets: Iterable[Iterable[str]]):
+        """
+        Precompute the per-slot food pools for known restriction sets.
+
+        Args:
+            restriction_sets: Restriction lists to prepare, e.g. [(), ('vegan',)]
+        """
+        for restrictions in restriction_sets:
+            self._best_foods(_restriction_key(restrictions))
+
     def generate_plan(self, model2_output: Dict) -> Dict:
         """
         Generate complete 4-meal daily plan from Model 2 output.
 
         Args:
             model2_output: Dictionary with target_calories, fitness_goal, dietary_restrictions
+                (a list, a frozenset used as the cache key directly, or a CSV string)
 
         Returns:
             Complete meal plan with chatbot message
@@ -413,8 +512,18 @@ class FoodRecommender:
             # Extract inputs
             target_calories = model2_output["target_calories"]
             fitness_goal = model2_output["fitness_goal"]
-            restrictions = model2_output.get("dietary_restrictions", [])
+            restrictions = _restriction_key(model2_output.get("dietary_restrictions", []))
+
+            return _json_loads(self._plan_json(target_calories, fitness_goal, restrictions))
+
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
 
+    def _build_plan(
+        self, target_calories: int, fitness_goal: str, restrictions: frozenset
+    ) -> Dict:
+        """Uncached body of generate_plan."""
+        try:
             # Calculate daily macros
             daily_macros = self.calculate_macros(target_calories, fitness_goal)
 
@@ -431,20 +540,21 @@ class FoodRecommender:
                     meal_calories, meal_protein, meal_carbs, meal_fat, restrictions
                 )
 
-            # Calculate daily summary
+            # Calculate daily summary in one pass over the meals
+            calories = protein_g = carbs_g = fat_g = 0
+            for meal in meal_plan.values():
+                calories += meal["total_calories"]
+                protein_g += meal["total_protein_g"]
+                carbs_g += meal["total_carbs_g"]
+                fat_g += meal["total_fat_g"]
+
             daily_summary = {
-                "calories": sum(meal["total_calories"] for meal in meal_plan.values()),
-                "protein_g": sum(
-                    meal["total_protein_g"] for meal in meal_plan.values()
-                ),
-                "carbs_g": sum(meal["total_carbs_g"] for meal in meal_plan.values()),
-                "fat_g": sum(meal["total_fat_g"] for meal in meal_plan.values()),
+                "calories": round(calories, 1),
+                "protein_g": round(protein_g, 1),
+                "carbs_g": round(carbs_g, 1),
+                "fat_g": round(fat_g, 1),
             }
 
-            # Round summary
-            for key in daily_summary:
-                daily_summary[key] = round(daily_summary[key], 1)
-
             # Calculate macro accuracy
             accuracy = (daily_summary["calories"] / target_calories) * 100
             daily_summary["macro_accuracy"] = f"{accuracy:.1f}%"
@@ -525,11 +635,11 @@ def test_performance():
         "dietary_restrictions": [],
     }
 
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     result = recommender.generate_plan(test_input)
-    end_time = time.time()
+    end_ns = time.perf_counter_ns()
 
-    execution_time_ms = (end_time - start_time) * 1000
+    execution_time_ms = (end_ns - start_ns) / 1_000_000
     print(f"[Performance] Execution time: {execution_time_ms:.2f}ms (target: <50ms)")
 
     return execution_time_ms < 50
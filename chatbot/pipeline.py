@@ -3,6 +3,8 @@ Unified Pipeline: Three-Model Integration
 Orchestrates Intent Classifier → Roadmap Generator → Food Recommender with safety validation.
 """
 
+import functools
+import logging
 import os
 import sys
 from typing import Dict, List, Tuple
@@ -15,6 +17,11 @@ from core.roadmap_generator import RoadmapGenerator
 from core.food_recommender import FoodRecommender
 from core.state_manager import StateManager
 
+# Per-message progress goes through logging so disabled levels cost no
+# formatting. No handler is added here: without app logging config,
+# warnings and errors still reach stderr through logging's last resort
+logger = logging.getLogger(__name__)
+
 
 class FitnessChatbotPipeline:
     """
@@ -31,6 +38,19 @@ class FitnessChatbotPipeline:
     MIN_PORTION = 50  # grams
     MAX_PORTION = 500  # grams
     CALORIE_TOLERANCE = 0.07  # ±7%
+    PROTEIN_CHECKED_MEALS = frozenset(("breakfast", "lunch", "dinner"))  # Not snack
+
+    # Intents answered with a full roadmap + meal plan
+    PLAN_INTENTS = frozenset(
+        (
+            "weight_loss_plan",
+            "muscle_gain_plan",
+            "maintenance_plan",
+            "diet_suggestion",
+            "food_plan",
+            "meal_plan",
+        )
+    )
 
     def __init__(self, base_dir: str = None):
         """
@@ -52,7 +72,7 @@ class FitnessChatbotPipeline:
         )
         print("  [OK] Model 1: Intent Classifier loaded")
 
-        self.roadmap_generator = RoadmapGenerator(
+        self.roadmap_generator = RoadmapGenerator.get(
             model_path=os.path.join(base_dir, "RoadMap_model", "roadmap_model.pkl")
         )
         print("  [OK] Model 2: Roadmap Generator loaded")
@@ -93,26 +113,21 @@ class FitnessChatbotPipeline:
         try:
             # STEP 1: Intent Classification (Model 1)
             intent = self.intent_classifier.predict(user_message)
-            print(f"[Pipeline] Intent detected: {intent}")
+            logger.debug("Intent detected: %s", intent)
 
             # STEP 2: State Management
             user_state = self.state_manager.get_user_state(user_id, intent)
-            print(
-                f"[Pipeline] User state loaded: Week {user_state['week']}, Goal: {user_state['fitness_goal']}"
+            logger.debug(
+                "User state loaded: Week %s, Goal: %s",
+                user_state["week"],
+                user_state["fitness_goal"],
             )
 
             # STEP 3: Check if this intent requires full pipeline
-            if intent in [
-                "weight_loss_plan",
-                "muscle_gain_plan",
-                "maintenance_plan",
-                "diet_suggestion",
-                "food_plan",
-                "meal_plan",
-            ]:
+            if intent in self.PLAN_INTENTS:
                 # STEP 4: Roadmap Generation (Model 2)
                 roadmap = self.roadmap_generator.predict(user_state)
-                print(f"[Pipeline] Roadmap generated: {roadmap['target_calories']} cal")
+                logger.debug("Roadmap generated: %s cal", roadmap["target_calories"])
 
                 # STEP 5: Food Recommendation (Model 3)
                 meal_result = self.food_recommender.generate_plan(
@@ -128,7 +143,7 @@ class FitnessChatbotPipeline:
                     }
 
                 meal_plan = meal_result["meal_plan"]
-                print(f"[Pipeline] Meal plan generated")
+                logger.debug("Meal plan generated")
 
                 # STEP 6: Safety Validation (MANDATORY)
                 is_safe, errors = self._validate_safety(
@@ -136,14 +151,14 @@ class FitnessChatbotPipeline:
                 )
 
                 if not is_safe:
-                    print(f"[Pipeline] [WARNING] Safety validation failed: {errors}")
+                    logger.warning("Safety validation failed: %s", errors)
                     return {
                         "status": "error",
                         "error": "Safety validation failed - regenerating plan",
                         "details": errors,
                     }
 
-                print(f"[Pipeline] [OK] Safety validation passed")
+                logger.debug("Safety validation passed")
 
                 # STEP 7: Natural Language Formatting
                 response = self._format_response(
@@ -154,8 +169,10 @@ class FitnessChatbotPipeline:
                 updated_state = self.state_manager.update_user_progress(
                     user_id, roadmap
                 )
-                print(
-                    f"[Pipeline] User progress updated: Week {user_state['week']} to {updated_state['week']}"
+                logger.debug(
+                    "User progress updated: Week %s to %s",
+                    user_state["week"],
+                    updated_state["week"],
                 )
 
                 return {
@@ -173,9 +190,8 @@ class FitnessChatbotPipeline:
                 return self._handle_other_intents(intent, user_state)
 
         except Exception as e:
-            import traceback
-
-            traceback.print_exc()
+            # Traceback is only formatted if a handler actually emits it
+            logger.exception("process_message failed for user %s", user_id)
             return {"status": "error", "error": str(e)}
 
     def _validate_safety(
@@ -188,27 +204,30 @@ class FitnessChatbotPipeline:
             Tuple of (is_valid, list_of_errors)
         """
         errors = []
+        portion_errors = []
+        min_protein = self.MIN_PROTEIN_PER_MEAL
+        min_portion, max_portion = self.MIN_PORTION, self.MAX_PORTION
 
-        # Gate 1: Minimum protein per meal
-        for meal_name in ["breakfast", "lunch", "dinner"]:
-            if meal_name in meal_plan:
-                protein = meal_plan[meal_name].get("total_protein_g", 0)
-                if protein < self.MIN_PROTEIN_PER_MEAL:
+        for meal_name, meal_data in meal_plan.items():
+            # Gate 1: Minimum protein per meal
+            if meal_name in self.PROTEIN_CHECKED_MEALS:
+                protein = meal_data.get("total_protein_g", 0)
+                if protein < min_protein:
                     errors.append(
-                        f"{meal_name} has insufficient protein: {protein}g < {self.MIN_PROTEIN_PER_MEAL}g"
+                        f"{meal_name} has insufficient protein: {protein}g < {min_protein}g"
                     )
 
-        # Gate 2: Portion sanity checks
-        for meal_name, meal_data in meal_plan.items():
-            for food in meal_data.get("foods", []):
+            # Gate 2: Portion sanity checks
+            for food in meal_data.get("foods", ()):
                 portion = food.get("portion_g", 0)
-                # Allow small portions for oils/fats
-                if portion > 50:  # Only check portions > 50g
-                    if portion < self.MIN_PORTION or portion > self.MAX_PORTION:
-                        errors.append(
-                            f"Unsafe portion in {meal_name}: {food['name']} = {portion}g"
-                        )
+                # Allow small portions for oils/fats: only check portions > 50g
+                if portion > 50 and not min_portion <= portion <= max_portion:
+                    portion_errors.append(
+                        f"Unsafe portion in {meal_name}: {food['name']} = {portion}g"
+                    )
 
+        # Protein errors are reported ahead of portion errors
+        errors.extend(portion_errors)
         return len(errors) == 0, errors
 
     def _format_response(
@@ -280,12 +299,23 @@ class FitnessChatbotPipeline:
             }
 
 
+
+@functools.lru_cache(maxsize=1)
+def get_pipeline(base_dir: str = None) -> FitnessChatbotPipeline:
+    """Process-wide pipeline, so scripts sharing a process load the models once."""
+    return FitnessChatbotPipeline(base_dir)
+
+
 # Standalone test
 if __name__ == "__main__":
     print("=" * 70)
     print("UNIFIED PIPELINE - Full Integration Test")
     print("=" * 70)
 
+    # Show the per-message pipeline trace
+    logging.basicConfig(format="[Pipeline] %(levelname)s: %(message)s")
+    logger.setLevel(logging.DEBUG)
+
     try:
         # Initialize pipeline
         pipeline = FitnessChatbotPipeline()
@@ -7,7 +7,7 @@ import os
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from pipeline import FitnessChatbotPipeline
+from pipeline import get_pipeline
 
 print("="  * 70)
 print("QUICK INTEGRATION TEST")
@@ -15,7 +15,7 @@ print("=" * 70)
 
 # Initialize pipeline
 print("\nInitializing pipeline...")
-pipeline = FitnessChatbotPipeline()
+pipeline = get_pipeline()
 
 # Test case: New user wants to lose weight
 print("\n[TEST] New user - weight loss request\n")
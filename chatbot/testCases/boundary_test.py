@@ -6,6 +6,7 @@ Run: python boundary_test.py
 
 import sys
 import os
+import re
 
 # Add project root to path (fixes import errors)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -13,24 +14,21 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 from core.conversation_manager import ConversationManager
 import json
 
+# Calorie figure in a response, e.g. "1842 kcal" or "2200 KCAL"
+_CAL_RE = re.compile(r"(\d{3,})\s*kcal", re.IGNORECASE)
 
-def test_boundary(profile_desc, goal_input, weight, height, age, activity):
-    manager = ConversationManager()
+
+def test_boundary(manager, profile_desc, goal_input, weight, height, age, activity):
     user_id = f"boundary_{profile_desc}"
 
     # Full conversation flow
-    manager.process_message(user_id, "hi")
-    manager.process_message(user_id, goal_input)
-    manager.process_message(user_id, str(weight))
-    manager.process_message(user_id, str(height))
-    manager.process_message(user_id, str(age))
-    response = manager.process_message(user_id, activity)
+    response = manager.process_messages(
+        user_id, ["hi", goal_input, str(weight), str(height), str(age), activity]
+    )[-1]
 
     # Extract calories
-    import re
-
     calories = 0
-    match = re.search(r"(\d{3,})\s*kcal", response.lower())
+    match = _CAL_RE.search(response)
     if match:
         calories = int(match.group(1))
 
@@ -66,9 +64,12 @@ test_cases = [
 print("=" * 70)
 print("BOUNDARY SAFETY TEST — Verifying calorie floors at extremes")
 print("=" * 70)
+# One manager (and one set of loaded models) for every case; each case
+# talks as its own user, and writes are debounced and flushed at exit
+manager = ConversationManager()
 results = []
 for case in test_cases:
-    passed, cal, preview = test_boundary(*case)
+    passed, cal, preview = test_boundary(manager, *case)
     results.append(passed)
 
 print("=" * 70)
@@ -10,6 +10,8 @@ import os
 
 # Add project root to path (fixes import errors)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Scenarios are throwaway conversations; keep them off disk
+os.environ["FITNESS_CHATBOT_PERSIST"] = "0"
 from core.conversation_manager import ConversationManager
 
 
@@ -21,11 +23,12 @@ def test_scenario(name, inputs):
     manager = ConversationManager()
     user_id = f"resilience_{name.replace(' ', '_')}"
 
-    for i, msg in enumerate(inputs, 1):
+    # Whole scenario in one batch, then replay the transcript
+    responses = manager.process_messages(user_id, inputs)
+    for i, (msg, response) in enumerate(zip(inputs, responses), 1):
         print(f"\nUser [{i}]: {msg}")
-        response = manager.process_message(user_id, msg)
         # Show first 2 lines of response
-        preview = "\n".join(response.split("\n")[:2])
+        preview = "\n".join(response.split("\n", 2)[:2])
         print(f"Bot  [{i}]: {preview}")
 
     return response
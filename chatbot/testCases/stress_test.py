@@ -1,70 +1,111 @@
 # Save as: stress_test.py
 """
 STRESS TEST — 100+ randomized profiles to uncover hidden edge cases
-Run: python stress_test.py [--save-report]
+Run: python stress_test.py [--save-report] [--seed N]
 """
 
-import sys
-import os
-
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-
 import sys
 import os
 import random
+import re
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json for report writing
+    orjson = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Stress runs don't need conversation state to survive on disk
+os.environ["FITNESS_CHATBOT_PERSIST"] = "0"
 from core.conversation_manager import ConversationManager
 
+# Calorie patterns compiled once, tried in priority order
+_CALORIE_PATTERNS = tuple(
+    re.compile(pattern)
+    for pattern in (
+        r"(\d{3,})\s*kcal",
+        r"daily totals[^}]*?calories?:\s*(\d{3,})",
+    )
+)
+
+
+def _json_line(obj) -> bytes:
+    """One compact JSON-lines record (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# Random profile vocabulary: (goal answer, fitness_goal) pairs and activities
+_GOALS = (
+    ("gain muscle", "muscle_gain"),
+    ("lose weight", "weight_loss"),
+    ("maintain weight", "maintenance"),
+)
+_ACTIVITIES = ("sedentary", "light", "moderate", "active", "very active")
+
 
 class StressTester:
-    def __init__(self, num_tests=100):
+    EDGE_CASES_SHOWN = 5
+
+    DEFAULT_SEED = 0xC0FFEE
+
+    def __init__(self, num_tests=100, seed=None):
         self.num_tests = num_tests
-        self.results = []
+        # Same seed, same profiles: a failing run can be replayed exactly
+        self.seed = self.DEFAULT_SEED if seed is None else seed
+        # Running summary; per-test results go to the report file, not memory
+        self.total = self.passed = self.safety_errors = 0
+        self.edge_cases = {}  # test_id -> result, lowest EDGE_CASES_SHOWN ids
+        self._manager = None
+
+    @property
+    def manager(self):
+        """One manager per process; tests are isolated by unique user_id"""
+        if self._manager is None:
+            # Default store, read-only (FITNESS_CHATBOT_PERSIST=0 above)
+            self._manager = ConversationManager()
+        return self._manager
 
     def generate_random_profile(self):
-        goals = [
-            ("gain muscle", "muscle_gain"),
-            ("lose weight", "weight_loss"),
-            ("maintain weight", "maintenance"),
-        ]
-        goal_input, goal_key = random.choice(goals)
+        goal_input, goal_key = random.choice(_GOALS)
 
+        # randrange(a, b + 1) is what randint(a, b) calls; same draws
         return {
             "goal_input": goal_input,
             "fitness_goal": goal_key,
-            "weight": random.randint(40, 200),
-            "height": random.randint(140, 250),
-            "age": random.randint(16, 85),
-            "activity": random.choice(
-                ["sedentary", "light", "moderate", "active", "very active"]
-            ),
+            "weight": random.randrange(40, 201),
+            "height": random.randrange(140, 251),
+            "age": random.randrange(16, 86),
+            "activity": random.choice(_ACTIVITIES),
         }
 
-    def run_test(self, profile, test_id):
+    def run_test(self, profile, user_id):
         try:
-            manager = ConversationManager()
-            user_id = f"stress_{test_id}_{int(datetime.now().timestamp() * 1000)}"
+            manager = self.manager
 
             # Full conversation
-            manager.process_message(user_id, "hi")
-            manager.process_message(user_id, profile["goal_input"])
-            manager.process_message(user_id, str(profile["weight"]))
-            manager.process_message(user_id, str(profile["height"]))
-            manager.process_message(user_id, str(profile["age"]))
-            response = manager.process_message(user_id, profile["activity"])
+            response = manager.process_messages(
+                user_id,
+                [
+                    "hi",
+                    profile["goal_input"],
+                    str(profile["weight"]),
+                    str(profile["height"]),
+                    str(profile["age"]),
+                    profile["activity"],
+                ],
+            )[-1]
 
             # Extract calories
-            import re
-
             calories = 0
-            for pattern in [
-                r"(\d{3,})\s*kcal",
-                r"daily totals[^}]*?calories?:\s*(\d{3,})",
-            ]:
-                match = re.search(pattern, response.lower())
+            response_lower = response.lower()
+            for pattern in _CALORIE_PATTERNS:
+                match = pattern.search(response_lower)
                 if match:
                     calories = int(match.group(1).replace(",", ""))
                     break
@@ -89,26 +130,68 @@ class StressTester:
 
     def run_suite(self):
         print(f"\n💥 Running stress test ({self.num_tests} randomized profiles)...")
+        print(f"Seed: {self.seed} (replay with --seed {self.seed})")
         print("=" * 70)
 
-        for i in range(self.num_tests):
-            profile = self.generate_random_profile()
-            result = self.run_test(profile, i)
-            self.results.append(result)
-
-            if i % 10 == 0:
-                print(f"Progress: {i}/{self.num_tests} tests completed", end="\r")
-
-        self.generate_report()
+        random.seed(self.seed)
+        # Profiles are drawn here so workers never repeat each other's draws
+        profiles = [self.generate_random_profile() for _ in range(self.num_tests)]
+        # i keeps ids unique within a run (across workers too); one clock
+        # read separates runs
+        run_stamp = time.time_ns() // 1_000_000
+
+        # Results stream to a JSON-lines report as they arrive; only running
+        # counts and the first few edge cases are kept in memory
+        report_path = None
+        report = None
+        if "--save-report" in sys.argv:
+            report_path = f"stress_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+            report = open(report_path, "wb")
 
-    def generate_report(self):
-        passed = sum(1 for r in self.results if r.get("passed", False))
-        safety_errors = sum(1 for r in self.results if r.get("has_safety_error", False))
-        total = len(self.results)
+        try:
+            # Tests share no state, so run them across worker processes
+            workers = min(os.cpu_count() or 1, self.num_tests) or 1
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+                futures = {
+                    ex.submit(_run_one, profile, f"stress_{i}_{run_stamp}"): i
+                    for i, profile in enumerate(profiles)
+                }
+                for done, future in enumerate(as_completed(futures)):
+                    self._record(futures[future], future.result(), report)
+
+                    if done % 10 == 0:
+                        print(f"Progress: {done}/{self.num_tests} tests completed", end="\r")
+        finally:
+            if report is not None:
+                report.close()
+
+        self.generate_report(report_path)
+
+    def _record(self, test_id, result, report=None):
+        """Fold one result into the running summary (and the report file)."""
+        self.total += 1
+        self.passed += bool(result.get("passed", False))
+        self.safety_errors += bool(result.get("has_safety_error", False))
+
+        calories = result.get("calories", 0)
+        if calories < 1000 or calories > 4000:
+            # Keep the lowest-numbered edge cases, whatever order tests finish in
+            self.edge_cases[test_id] = result
+            if len(self.edge_cases) > self.EDGE_CASES_SHOWN:
+                del self.edge_cases[max(self.edge_cases)]
+
+        if report is not None:
+            report.write(_json_line(result))
+
+    def generate_report(self, report_path=None):
+        passed = self.passed
+        safety_errors = self.safety_errors
+        total = self.total
 
         print("\n" + "=" * 70)
         print("STRESS TEST REPORT")
         print("=" * 70)
+        print(f"Seed:             {self.seed}")
         print(f"Total tests:      {total}")
         print(f"Passed:           {passed} ✅ ({passed / total * 100:.1f}%)")
         print(
@@ -121,33 +204,41 @@ class StressTester:
         print("=" * 70)
 
         # Show interesting edge cases
-        edge_cases = [
-            r
-            for r in self.results
-            if r.get("calories", 0) < 1000 or r.get("calories", 0) > 4000
-        ]
-        if edge_cases:
+        if self.edge_cases:
             print("\n🔍 Interesting edge cases (calories <1000 or >4000):")
-            for r in edge_cases[:5]:  # Show first 5
+            for test_id in sorted(self.edge_cases):  # First few, in test order
+                r = self.edge_cases[test_id]
                 p = r["profile"]
                 print(
                     f"   • {p['fitness_goal']}: {p['weight']}kg/{p['height']}cm/{p['age']}yo → {r['calories']} kcal"
                 )
 
-        # Save report if requested
-        if "--save-report" in sys.argv:
-            filename = f"stress_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(filename, "w") as f:
-                json.dump(
-                    {"timestamp": datetime.now().isoformat(), "tests": self.results},
-                    f,
-                    indent=2,
-                )
-            print(f"\n💾 Report saved: {filename}")
+        if report_path is not None:
+            print(f"\n💾 Report saved: {report_path}")
 
         print("=" * 70)
 
 
+# Per-process tester used by pool workers (built once in _init_worker)
+_worker_tester = None
+
+
+def _init_worker():
+    global _worker_tester
+    _worker_tester = StressTester()
+
+
+def _run_one(profile, user_id):
+    return _worker_tester.run_test(profile, user_id)
+
+
+def _parse_seed(argv):
+    """--seed N from the command line, else STRESS_SEED, else the default."""
+    if "--seed" in argv:
+        return int(argv[argv.index("--seed") + 1])
+    return int(os.environ.get("STRESS_SEED", 0)) or StressTester.DEFAULT_SEED
+
+
 if __name__ == "__main__":
-    tester = StressTester(num_tests=100)
+    tester = StressTester(num_tests=100, seed=_parse_seed(sys.argv))
     tester.run_suite()
